@@ -0,0 +1,231 @@
+# Benchmarks of the Mobility pipeline with regression tracking
+# Bhavik Harish Lodhia
+#
+#   python bench.py                           run all benchmarks, write bench.json
+#   python bench.py --save                    also store them as the baseline
+#   python bench.py --baseline base.json      compare against a saved baseline
+#   python bench.py --quick --only pure       small sizes, pure fluid EOS only
+#
+# Each benchmark is timed repeat times (best time is reported as points per
+# second) plus once more under tracemalloc for the peak memory. Results are
+# written as JSON; a benchmark is a regression when its throughput drops or
+# its peak memory grows by more than the tolerance (default 20%) relative to
+# the baseline, in which case the exit status is 1
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import tracemalloc
+import warnings
+import numpy as np
+import data
+import permeability
+import viscosity
+import mobility
+import output
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "bench_baseline.json")
+
+EOSS = ("PR78", "SRK", "RK", "VDW", "TWUPR", "APISRK", "TWUSRK")
+
+# Lithologies with Holmes (2009) constants, i.e. all clastics and carbonates
+ROCKS = [rock for rock, family, cls in data.ROCKS
+         if cls in permeability.HOLMES]
+
+###############################################################################
+
+class Bench:
+
+    # Benchmarks: each takes the size scale (1 for full size) and returns a
+    # function running the workload and the number of points it evaluates.
+    # Set up (tables, arrays) happens outside the timed function
+
+    def Run(scale):
+
+        # single Run.run profile, as in run.py
+        depths = list(np.linspace(0, 5, max(2, int(50*scale))))
+        def work():
+            viscosity.Viscosity.CacheClear()
+            permeability.Profile.CacheClear()
+            mobility.Run.run("H2", "Sandstone", depths, 20., 3, "PR78",
+                             output="off", plot="off", save="false")
+        return work, len(depths)
+
+    def Sweep(scale):
+
+        # every clastic and carbonate lithology at every setting
+        depths = np.linspace(0, 5, max(2, int(200*scale)))
+        settings = sorted(data.SETTINGS)
+        def work():
+            viscosity.Viscosity.CacheClear()
+            permeability.Profile.CacheClear()
+            mobility.Run.sweep(["H2"], ROCKS, depths, settings=settings)
+        return work, len(ROCKS)*len(settings)*len(depths)
+
+    def Pure(eos):
+
+        # Viscosity.Pure one state at a time for one equation of state
+        def bench(scale):
+            name, Vc = data.Fluid.Name("H2")
+            T, P = data.Data.PTArray(3, np.linspace(0, 5, max(2, int(200*scale))), 20.)
+            states = list(zip(T.tolist(), (P*1e6).tolist()))
+            def work():
+                viscosity.Viscosity.CacheClear()
+                for t, p in states:
+                    viscosity.Viscosity.Pure(name, eos, Vc, t, p)
+            return work, len(states)
+        return bench
+
+    def Profile(scale):
+
+        # vectorized fluid properties of a whole depth profile
+        name, Vc = data.Fluid.Name("H2")
+        T, P = data.Data.PTArray(3, np.linspace(0, 5, max(2, int(100000*scale))), 20.)
+        def work():
+            viscosity.Viscosity.Profile(name, "PR78", Vc, T, P*1e6)
+        return work, len(T)
+
+    def K(scale):
+
+        # multipoint permeability over a large porosity array
+        n = max(2, int(1000000*scale))
+        rows = np.arange(n) % len(data.ROCKS)
+        porosity = np.random.default_rng(1).uniform(0.01, 0.5, n)
+        def work():
+            permeability.Profile.k(rows, porosity)
+        return work, n
+
+    def SwiZ(scale):
+
+        # Athy porosity and Holmes Swi over a large depth array
+        n = max(2, int(1000000*scale))
+        rows = data.Data.Ids(ROCKS)[np.arange(n) % len(ROCKS)]
+        depth = np.random.default_rng(1).uniform(0, 5, n)
+        def work():
+            permeability.Profile.SwiZ(rows, depth)
+        return work, n
+
+    def Benchmarks():
+
+        # name -> benchmark
+        benchmarks = {"run": Bench.Run, "sweep": Bench.Sweep}
+        for eos in EOSS:
+            benchmarks["pure_" + eos] = Bench.Pure(eos)
+        benchmarks.update({"profile": Bench.Profile, "k": Bench.K,
+                           "swiz": Bench.SwiZ})
+        return benchmarks
+
+###############################################################################
+
+    def Time(bench, scale=1., repeat=3):
+
+        # Best wall time over repeat runs and peak traced memory of one run
+        work, points = bench(scale)
+        work()                                  # warm up imports and tables
+
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            work()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            work()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        best = min(times)
+        return {"points": points, "seconds": best, "mean_seconds": float(np.mean(times)),
+                "points_per_second": points/best, "peak_mb": peak/2**20}
+
+    def All(only=None, scale=1., repeat=3):
+
+        # Results of the benchmarks whose names contain one of only (all with
+        # only=None), with the environment they ran in
+        results = {}
+        for name, bench in Bench.Benchmarks().items():
+            if only and not any(part in name for part in only):
+                continue
+            results[name] = Bench.Time(bench, scale, repeat)
+            print("%-14s %12.0f points/s %10.1f MB"
+                  % (name, results[name]["points_per_second"], results[name]["peak_mb"]))
+
+        return {"software": "hydrogen_mobility", "version": output.Output.Version(),
+                "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "python": platform.python_version(), "numpy": np.__version__,
+                "platform": platform.platform(), "cpus": os.cpu_count(),
+                "scale": scale, "repeat": repeat, "results": results}
+
+    def Compare(current, baseline, tolerance=0.2):
+
+        # Benchmarks slower or using more memory than the baseline by more than
+        # tolerance, as a list of messages
+        if current["scale"] != baseline.get("scale"):
+            print("Warning: baseline was run with scale %s, now %s"
+                  % (baseline.get("scale"), current["scale"]))
+
+        regressions = []
+        for name, now in current["results"].items():
+            base = baseline["results"].get(name)
+            if base is None:
+                continue
+            speed = now["points_per_second"]/base["points_per_second"]
+            memory = now["peak_mb"]/max(base["peak_mb"], 1e-6)
+            flag = ""
+            if speed < 1 - tolerance:
+                flag = "SLOWER"
+                regressions.append("%s: %.0f%% of baseline throughput" % (name, 100*speed))
+            if memory > 1 + tolerance and now["peak_mb"] - base["peak_mb"] > 1:
+                flag = (flag + " MEMORY").strip()
+                regressions.append("%s: peak memory %.1f MB, baseline %.1f MB"
+                                   % (name, now["peak_mb"], base["peak_mb"]))
+            print("%-14s speed x%.2f memory x%.2f %s" % (name, speed, memory, flag))
+
+        return regressions
+
+###############################################################################
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Benchmark the Mobility pipeline")
+    parser.add_argument("--out", default=os.path.join(HERE, "bench.json"),
+                        help="results file (default bench.json)")
+    parser.add_argument("--baseline", default=BASELINE,
+                        help="baseline to compare with (default bench_baseline.json)")
+    parser.add_argument("--save", action="store_true",
+                        help="store the results as the new baseline")
+    parser.add_argument("--only", nargs="+",
+                        help="run the benchmarks whose names contain these")
+    parser.add_argument("--quick", action="store_true",
+                        help="run at 1/10 of the full sizes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative loss before flagging (default 0.2)")
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter("ignore")
+    current = Bench.All(args.only, 0.1 if args.quick else 1., args.repeat)
+    with open(args.out, "w") as f:
+        json.dump(current, f, indent=1)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            regressions = Bench.Compare(current, json.load(f), args.tolerance)
+        for message in regressions:
+            print("Regression:", message)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=1)
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
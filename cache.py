@@ -0,0 +1,291 @@
+# Caches shared by the Mobility modules
+# Bhavik Harish Lodhia
+
+import os
+import glob
+import time
+import sqlite3
+import hashlib
+import zipfile
+import threading
+from collections import OrderedDict
+import numpy as np
+
+_missing = object()
+
+###############################################################################   
+
+class LRU:
+
+    # Bounded least-recently-used cache with hit/miss statistics. maxsize is
+    # the number of entries and maxbytes the total of the sizes passed to put
+    # (e.g. the bytes of numpy arrays); None never evicts on that bound
+
+    def __init__(self, maxsize=100000, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self.data.get(key, _missing)
+        if value is _missing:
+            self.misses += 1
+            return default
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, nbytes=0):
+        self.nbytes += nbytes - self.sizes.get(key, 0)
+        self.sizes[key] = nbytes
+        self.data[key] = value
+        self.data.move_to_end(key)
+        self.evict()
+
+    def resize(self, maxsize, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.evict()
+
+    def evict(self):
+        # drop the least recently used entries until both bounds hold, an
+        # entry larger than maxbytes on its own is not kept at all
+        while self.data and ((self.maxsize is not None and 
+                              len(self.data) > self.maxsize) or
+                             (self.maxbytes is not None and 
+                              self.nbytes > self.maxbytes)):
+            key, value = self.data.popitem(last=False)
+            self.nbytes -= self.sizes.pop(key)
+
+    def clear(self):
+        self.data.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, 
+                "size": len(self.data), "maxsize": self.maxsize,
+                "nbytes": self.nbytes, "maxbytes": self.maxbytes}
+
+    def __len__(self):
+        return len(self.data)
+
+###############################################################################   
+
+class Disk:
+
+    # Dicts of numpy arrays persisted as one .npz file per key in a directory,
+    # so they survive between processes. Keys are hex digests. Files are
+    # written to a temporary name first, so a reader never sees a partly 
+    # written file; unreadable files count as misses
+
+    def __init__(self, path, prefix="cache"):
+        self.path = path
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, key):
+        return os.path.join(self.path, "%s-%s.npz" % (self.prefix, key))
+
+    def get(self, key):
+        try:
+            with np.load(self.file(key)) as f:
+                arrays = {name: f[name] for name in f.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def put(self, key, arrays):
+        tmp = self.file(key) + ".%d.tmp" % os.getpid()
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.file(key))
+
+    def clear(self):
+        for file in glob.glob(os.path.join(self.path, self.prefix + "-*.npz")):
+            os.remove(file)
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        files = glob.glob(os.path.join(self.path, self.prefix + "-*.npz"))
+        return {"hits": self.hits, "misses": self.misses, "path": self.path,
+                "files": len(files), 
+                "bytes": sum(os.path.getsize(file) for file in files)}
+
+###############################################################################   
+
+class Store:
+
+    # Key-value store of bytes in a SQLite database, shared by processes and
+    # runs. The database is in WAL mode so readers do not block the writer;
+    # each process opens its own connection. When the stored values pass 
+    # maxbytes the least recently used are deleted down to 90% of it. Reads
+    # do not write: the last use of entries read is recorded in batches (see
+    # Store.touch), so concurrent readers do not wait for the write lock.
+    # Keys are content hashes, see Store.key
+    #
+    #   store = Store("results.sqlite", maxbytes=2**30)
+    #   key = Store.key("mobility", fluid, rock_params, depths)
+    #   value = store.get(key)
+    #   if value is None:
+    #       store.put(key, compute())
+
+    def __init__(self, path, maxbytes=2**30):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+        self.used = {}                  # last use of entries read, not stored yet
+        self.touched = time.time()
+        self.conn = None
+        self.pid = None
+        self.lock = threading.Lock()
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self.connect()
+
+    def connect(self):
+
+        # Connection of this process, opened again after a fork
+        if self.conn is None or self.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, "
+                         "value BLOB NOT NULL, size INTEGER NOT NULL, "
+                         "used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+            self.conn = conn
+            self.pid = os.getpid()
+
+        return self.conn
+
+    def key(*parts):
+
+        # sha256 of strings, numbers, tuples and numpy arrays (by dtype, shape
+        # and contents)
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                part = np.ascontiguousarray(part)
+                digest.update(("%s%s" % (part.dtype.str, part.shape)).encode())
+                digest.update(part.tobytes())
+            else:
+                digest.update(repr(part).encode())
+            digest.update(b"\0")
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", 
+                               (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.used[key] = time.time()
+            if len(self.used) >= 1000 or self.used[key] - self.touched > 60:
+                self.touch()
+            return bytes(row[0])
+
+    def put(self, key, value):
+        with self.lock:
+            self.connect().execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                   (key, sqlite3.Binary(value), len(value), time.time()))
+            self.written += len(value)
+            # check the size now and then rather than on every write
+            if self.maxbytes is not None and self.written > self.maxbytes/20:
+                self.written = 0
+                self.evict()
+
+    def touch(self):
+
+        # Store the last use of the entries read since the last call, in one
+        # transaction
+        if self.used:
+            conn = self.connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("UPDATE entries SET used = ? WHERE key = ?",
+                                 [(used, key) for key, used in self.used.items()])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self.used = {}
+        self.touched = time.time()
+
+    def flush(self):
+        # store the last use of entries read now, e.g. at the end of a task
+        with self.lock:
+            self.touch()
+
+    def evict(self):
+
+        # Delete the least recently used entries until the values take at most
+        # 90% of maxbytes
+        self.touch()
+        conn = self.connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total > self.maxbytes:
+                excess = total - 0.9*self.maxbytes
+                keys = []
+                for key, size in conn.execute("SELECT key, size FROM entries "
+                                              "ORDER BY used"):
+                    if excess <= 0:
+                        break
+                    keys.append((key,))
+                    excess -= size
+                conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        with self.lock:
+            self.connect().execute("DELETE FROM entries")
+            self.used = {}
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self.lock:
+            count, size = self.connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "path": self.path,
+                "entries": count, "bytes": size, "maxbytes": self.maxbytes}
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.touch()
+                self.conn.close()
+            self.conn = None
+
+    def __getstate__(self):
+        # pickled (e.g. for worker processes) without the connection
+        state = dict(self.__dict__)
+        state.update(conn=None, pid=None, lock=None, used={})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
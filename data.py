@@ -1,8 +1,104 @@
 # Class to set up Mobility module data parameters
 # Bhavik Harish Lodhia
 
+import os
+import hashlib
+from collections import namedtuple
+import numpy as np
 import pandas as pd  
 from thermo import ChemicalConstantsPackage
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+PERMEABILITY_CSV = os.path.join(DATA_DIR, "permeability.csv")
+COMPACTION_CSV = os.path.join(DATA_DIR, "compaction.csv")
+FLUIDS_CSV = os.path.join(DATA_DIR, "fluids.csv")
+KIJ_CSV = os.path.join(DATA_DIR, "kij.csv")
+
+# Parameters of one lithology: multipoint permeability (ak, phi0-2, k0-2) 
+# and Athy compaction (dpor = depositional porosity, athyk in km)
+Lithology = namedtuple("Lithology", ["row", "ak", "phi0", "phi1", "phi2", 
+                                     "k0", "k1", "k2", "dpor", "athyk"])
+
+# Rock types in the row order of the csv files, with the rock family and
+# lithology class of each
+ROCKS = [
+    ("Limestone-OG", "Limestone", "carbonate"),
+    ("Limestone-WM", "Limestone", "carbonate"),
+    ("Micrite", "Limestone", "carbonate"),
+    ("Limestone-shaley", "Limestone", "carbonate"),
+    ("Limestone-orgrich", "Limestone", "carbonate"),
+    ("Limestone-TOC1-2", "Limestone", "carbonate"),
+    ("Limestone-TOC10", "Limestone", "carbonate"),
+    ("Marl", "Marl", "carbonate"),
+    ("Dolomite", "Dolomite", "carbonate"),
+    ("Dolomite-sandy", "Dolomite", "carbonate"),
+    ("Dolomite-silty", "Dolomite", "carbonate"),
+    ("Dolomite-org", "Dolomite", "carbonate"),
+    ("Chalk", "Chalk", "carbonate"),
+    ("Chalk-calcite95", "Chalk", "carbonate"),
+    ("Chalk-calcite75", "Chalk", "carbonate"),
+    ("Chalk-calcite40", "Chalk", "carbonate"),
+    ("Coal", "Coal", "coal"),
+    ("Coal-impure", "Coal", "coal"),
+    ("Coal-silty", "Coal", "coal"),
+    ("Sandstone", "Sandstone", "clastic"),
+    ("Sandstone-clayrich", "Sandstone", "clastic"),
+    ("Sandstone-claypoor", "Sandstone", "clastic"),
+    ("Quartzite", "Quartzite", "clastic"),
+    ("Quartzite-quartz", "Quartzite", "clastic"),
+    ("Subarkose", "Subarkose", "clastic"),
+    ("Subarkose-quartz", "Subarkose", "clastic"),
+    ("Subarkose-clayrich", "Subarkose", "clastic"),
+    ("Subarkose-claypoor", "Subarkose", "clastic"),
+    ("Subarkose-dolomite", "Subarkose", "clastic"),
+    ("Arkose", "Arkose", "clastic"),
+    ("Arkose-quartzrich", "Arkose", "clastic"),
+    ("Arkose-quartzpoor", "Arkose", "clastic"),
+    ("Arkose-clayrich", "Arkose", "clastic"),
+    ("Arkose-claypoor", "Arkose", "clastic"),
+    ("Arkose-dolomite", "Arkose", "clastic"),
+    ("Wacke", "Wacke", "clastic"),
+    ("Shale", "Shale", "shale"),
+    ("Shale-orglean", "Shale", "shale"),
+    ("Shale-sandy", "Shale", "shale"),
+    ("Shale-silty", "Shale", "shale"),
+    ("Shale-silicious", "Shale", "shale"),
+    ("Shale-opalCT", "Shale", "shale"),
+    ("Shale-black", "Shale", "shale"),
+    ("Shale-orgrich", "Shale", "shale"),
+    ("Shale-TOC3", "Shale", "shale"),
+    ("Shale-TOC8", "Shale", "shale"),
+    ("Shale-TOC20", "Shale", "shale"),
+    ("Siltstone", "Siltstone", "clastic"),
+    ("Siltstone-orgrich", "Siltstone", "clastic"),
+    ("Siltstone-TOC10", "Siltstone", "clastic"),
+    ("Siltstone-TOC2-3", "Siltstone", "clastic"),
+    ("Conglomerate", "Conglomerate", "clastic"),
+    ("Conglomerate-quartzite", "Conglomerate", "clastic"),
+    ("Tuff-felsic", "Tuff", "volcanic"),
+    ("Tuff-basaltic", "Tuff", "volcanic"),
+    ]
+
+CLASSES = ("clastic", "carbonate", "shale", "coal", "volcanic")
+
+# PT gradient in MPa/K for each geological setting (see Data.PT): 1 = cool 
+# overpressured, 2 = overpressured, 3 = typical, 4 = hydrostatic, 5 = hot 
+# hydrostatic, all with a geothermal gradient of 25 degrees/km
+SETTINGS = {1: 2.5, 2: 1.0, 3: 0.5, 4: 0.3, 5: 0.1}
+
+# Other accepted spellings of rock names
+ALIASES = {"Quartzite_quartz": "Quartzite-quartz"}
+
+# Lithology tables are parsed once per process and kept here (see Data.Load)
+_store = {}
+
+# Setting objects of the SETTINGS numbers (see Data.Setting)
+_settings = {}
+
+# Constants packages and critical volumes of the fluids in fluids.csv, built
+# once per process (see Fluid.Load), and the kij.csv interaction parameters
+_fluids = {}
+_fluids_kij = {}
   
 ###############################################################################   
 
@@ -11,190 +107,319 @@ class Data:
     
     def Params():
 
+        # Tables are read from disk on first use only, call Data.Reload() after
+        # editing the csv files
+        if not _store:
+            Data.Load()
+        
+        return _store["df"], _store["athy"], _store["compaction"]
+
+    def Load():
+
         header_list = ["Rock","ak","phi0","phi1","phi2","k0","k1","k2"]     
-        df = pd.read_csv("data/permeability.csv", names=header_list)        
+        df = pd.read_csv(PERMEABILITY_CSV, names=header_list)        
 #        x = df[['Rock', 'ak', 'phi0','k0','phi1','k1','phi2','k2']]
         compaction_headers = ["Rock","phi0","athy_k_km","athy_k_MPa","Cmax","Cmin", \
                               "ka","kb","phi"]
-        compaction = pd.read_csv("data/compaction.csv", names=compaction_headers)        
+        compaction = pd.read_csv(COMPACTION_CSV, names=compaction_headers)        
         athy = compaction[['Rock', 'phi0', 'athy_k_km']]   
+
+        # numpy copies, one row per lithology
+        perm = df[header_list[1:]].to_numpy(dtype=float)   # ak, phi0-2, k0-2
+        comp = athy[['phi0', 'athy_k_km']].to_numpy(dtype=float) # dpor, athyk
+
+        if len(perm) != len(ROCKS) or len(comp) != len(ROCKS):
+            raise ValueError("Lithology tables must have one row per rock type "
+                             "in data.ROCKS (%d)" % len(ROCKS))
+
+        # name -> row lookup for short names, csv names and aliases
+        ids = {}
+        for row, (rock, family, cls) in enumerate(ROCKS):
+            ids[rock] = row
+            ids[str(df.Rock[row]).strip()] = row
+        for alias, rock in ALIASES.items():
+            ids[alias] = ids[rock]
+
+        _store.clear()
+        _store["ids"] = ids
+        _store["classes"] = np.array([CLASSES.index(cls) for rock, family, cls 
+                                      in ROCKS])
+        _store["df"] = df
+        _store["athy"] = athy
+        _store["compaction"] = compaction
+        _store["perm"] = perm
+        _store["comp"] = comp
+        _store["rocks"] = [Lithology(row, *perm[row].tolist(), *comp[row].tolist()) 
+                           for row in range(len(perm))]
+        _store["mtimes"] = Data.Mtimes()
+        _store["stamp"] = Data.Digest()
+
+    def Mtimes():
+        return (os.path.getmtime(PERMEABILITY_CSV), os.path.getmtime(COMPACTION_CSV))
+
+    def Digest():
+
+        # sha256 of the contents of both lithology tables
+        digest = hashlib.sha256()
+        for path in (PERMEABILITY_CSV, COMPACTION_CSV):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+
+        return digest.hexdigest()
+
+    def Stamp():
+
+        # Digest of the lithology tables, for keying cached results (see 
+        # permeability.Profile.Rock) so they change with the tables. Tables
+        # changed on disk since they were loaded are read again first (see 
+        # Data.Reload), so the cached results and the tables stay in step
+        Data.Reload()
+
+        return _store["stamp"]
+
+    def Reload(force=False):
+
+        # Re-read the lithology tables if the csv files changed on disk since 
+        # they were loaded (always with force=True). Returns True on reload
+        if force or not _store or _store["mtimes"] != Data.Mtimes():
+            Data.Load()
+            return True
         
-        return df, athy, compaction
+        return False
+
+    def Invalidate():
+        # Drop the tables, the next call to Data.Params reads them again
+        _store.clear()
+
+    def Rock(rock):
+
+        # Lithology record for a rock name or id
+        if not _store:
+            Data.Load()
+
+        return _store["rocks"][Data.Name(rock)]
+
+    def Arrays():
+
+        # Parameters of all lithologies as numpy arrays indexed by row:
+        # perm columns ak, phi0, phi1, phi2, k0, k1, k2; comp columns dpor, athyk
+        if not _store:
+            Data.Load()
+
+        return _store["perm"], _store["comp"]
 
     def Name(rock):
 
-        # Assign row number for each lithology
-        if rock == "Limestone-OG":
-            row = 0
-        elif rock == "Limestone-WM":
-            row = 1
-        elif rock == "Micrite":
-            row = 2
-        elif rock == "Limestone-shaley":
-            row = 3   
-        elif rock == "Limestone-orgrich":
-            row = 4   
-        elif rock == "Limestone-TOC1-2":
-            row = 5        
-        elif rock == "Limestone-TOC10":
-            row = 6               
-        elif rock == "Marl":
-            row = 7              
-        elif rock == "Dolomite":
-            row = 8          
-        elif rock == "Dolomite-sandy":
-            row = 9         
-        elif rock == "Dolomite-silty":
-            row = 10           
-        elif rock == "Dolomite-org":
-            row = 11
-        elif rock == "Chalk":
-            row = 12   
-        elif rock == "Chalk-calcite95":
-            row = 13           
-        elif rock == "Chalk-calcite75":
-            row = 14            
-        elif rock == "Chalk-calcite40":
-            row = 15   
-        elif rock == "Coal":
-            row = 16 
-        elif rock == "Coal-impure":
-            row = 17 
-        elif rock == "Coal-silty":
-            row = 18            
-        elif rock == "Sandstone":
-            row = 19
-        elif rock == "Sandstone-clayrich":
-            row = 20
-        elif rock == "Sandstone-claypoor":
-            row = 21
-        elif rock == "Quartzite":
-            row = 22
-        elif rock == "Quartzite_quartz":
-            row = 23
-        elif rock == "Subarkose":
-            row = 24
-        elif rock == "Subarkose-quartz":
-            row = 25
-        elif rock == "Subarkose-clayrich":
-            row = 26
-        elif rock == "Subarkose-claypoor":
-            row = 27
-        elif rock == "Subarkose-dolomite":
-            row = 28
-        elif rock == "Arkose":
-            row = 29
-        elif rock == "Arkose-quartzrich":
-            row = 30
-        elif rock == "Arkose-quartzpoor":
-            row = 31
-        elif rock == "Arkose-clayrich":
-            row = 32
-        elif rock == "Arkose-claypoor":
-            row = 33
-        elif rock == "Arkose-dolomite":
-            row = 34
-        elif rock == "Wacke":
-            row = 35     
-        elif rock == "Shale":
-            row = 36         
-        elif rock == "Shale-orglean":
-            row = 37          
-        elif rock == "Shale-sandy":
-            row = 38          
-        elif rock == "Shale-silty":
-            row = 39          
-        elif rock == "Shale-silicious":
-            row = 40        
-        elif rock == "Shale-opalCT":
-            row = 41  
-        elif rock == "Shale-black":
-            row = 42  
-        elif rock == "Shale-orgrich":
-            row = 43  
-        elif rock == "Shale-TOC3":
-            row = 44  
-        elif rock == "Shale-TOC8":
-            row = 45  
-        elif rock == "Shale-TOC20":
-            row = 46  
-        elif rock == "Siltstone":
-            row = 47
-        elif rock == "Siltstone-orgrich":
-            row = 48
-        elif rock == "Siltstone-TOC10":
-            row = 49
-        elif rock == "Siltstone-TOC2-3":
-            row = 50
-        elif rock == "Conglomerate":
-            row = 51
-        elif rock == "Conglomerate-quartzite":
-            row = 52
-        elif rock == "Tuff-felsic":
-            row = 53        
-        elif rock == "Tuff-basaltic":
-            row = 54  
-
-        return row  
+        # Row number (integer id) of a lithology from its name, its name in the
+        # csv files or the id itself
+        if not _store:
+            Data.Load()
+
+        if isinstance(rock, (int, np.integer)) and not isinstance(rock, bool):
+            if 0 <= rock < len(ROCKS):
+                return int(rock)
+        else:
+            row = _store["ids"].get(rock)
+            if row is not None:
+                return row
+
+        raise ValueError("Unknown rock type %r, see data.ROCKS for the list of "
+                         "rock types" % (rock,))
+
+    def Ids(rock):
+
+        # Integer ids for a rock name/id or an array of rock names/ids, as a 
+        # numpy array of the same shape
+        if isinstance(rock, (str, int, np.integer)):
+            return np.array(Data.Name(rock), dtype=np.intp)
+
+        values = np.asarray(rock)
+        if values.dtype.kind in "iu":
+            if values.size and (values.min() < 0 or values.max() >= len(ROCKS)):
+                raise ValueError("Rock ids must be between 0 and %d" 
+                                 % (len(ROCKS) - 1))
+            return values.astype(np.intp)
+
+        # names, or names and ids mixed (e.g. ["Sandstone", 3]), each distinct
+        # value looked up as it is: as one string array the ids became names
+        values = np.asarray(rock, dtype=object)
+        codes, uniques = pd.factorize(values.ravel(), use_na_sentinel=False)
+        ids = np.array([Data.Name(value) for value in uniques], dtype=np.intp)
+        return ids[codes].reshape(values.shape)
+
+    def Family(rock):
+        # Rock family, e.g. "Sandstone" for "Sandstone-clayrich"
+        return ROCKS[Data.Name(rock)][1]
+
+    def Class(rock):
+        # Lithology class, one of CLASSES
+        return ROCKS[Data.Name(rock)][2]
+
+    def Classes():
+
+        # Index into CLASSES of every lithology, as a numpy array indexed by row
+        if not _store:
+            Data.Load()
+
+        return _store["classes"]
 
 ###############################################################################   
 
     def PT(setting, depth, tsurf):
-        # Assuming a geothermal gradient of 25 degrees/km, change as required
-    
-        temp = (depth*25) + tsurf  # depth in km for consistency with other functions
-                                   # temperature in degrees celsius, convert to K
-                                   # temperature at surface set to 20 degrees
-    
-        # PT gradients for each geological setting
-        if setting == 1:         # 1 = cool overpressured, 2.5 MPa/K
-            m = 2.5
-        elif setting ==2:        # 2 = overpressured, 1.0 MPa/K
-            m = 1.0
-        elif setting == 3:       # 3 = typical, 0.5 MPa/k
-            m = 0.5
-        elif setting == 4:       # 4 = hydrostatic, 0.3 MPa/K
-            m = 0.3
-        elif setting == 5:       # 5 = hot hydrostatic, 0.1 MPa/K
-            m = 0.1
-    
-        # calculate graph intercept from tsurf
-        C = -1*tsurf*m    
-    
-        pressure = m*temp + C
-   
+
+        # Temperature (K) and pressure (MPa) at one depth (km) for a geological 
+        # setting, a number from SETTINGS or a Setting (see Data.Setting)
+        T, P = Data.Setting(setting).pt(depth, tsurf)
+
+        return setting, float(T), float(P)
+
+    def PTArray(setting, depth, tsurf):
+
+        # Data.PT for a numpy array of depths (km), returns temperature in kelvin
+        # and pressure in MPa as arrays
+        return Data.Setting(setting).pt(depth, tsurf)
+
+    def Setting(setting):
+
+        # Setting for a setting number (see SETTINGS) or a Setting, e.g. 
+        # Setting(gradient=30) for a hotter basin at typical pressures
+        if isinstance(setting, Setting):
+            return setting
+        if not isinstance(setting, bool) and setting in SETTINGS:
+            if setting not in _settings:
+                _settings[setting] = Setting(m=SETTINGS[setting], name=setting)
+            return _settings[setting]
+
+        raise ValueError("Unknown geological setting %r, choose from %s or pass "
+                         "a data.Setting" % (setting, sorted(SETTINGS)))
+
+###############################################################################
+
+class Setting:
+
+    # Temperature and pressure against depth. Temperature rises from tsurf
+    # with the geothermal gradient (degrees/km, 25 by default). Pressure 
+    # follows the PT gradient m (MPa/K) of the settings of Lodhia & Clark 
+    # (2022), see SETTINGS, or with pressure set a pressure gradient (MPa/km, 
+    # e.g. 10 hydrostatic, 25 lithostatic) from 1 atm at the surface. Pressure
+    # never drops below 1 atm.
+    # For piecewise profiles depths gives the top (km) of each interval, 
+    # starting at 0, and gradient and pressure one value per interval; the 
+    # last interval continues to any depth, e.g.
+    #
+    #   Setting(gradient=[20, 35], pressure=[10, 18], depths=[0, 2.5])
+
+    def __init__(self, gradient=25., m=0.5, pressure=None, depths=(0.,), 
+                 name="custom"):
+
+        self.depths = np.atleast_1d(np.asarray(depths, dtype=float))
+        if self.depths[0] != 0 or np.any(np.diff(self.depths) <= 0):
+            raise ValueError("Setting depths must start at 0 and increase")
+
+        self.gradient = self.intervals(gradient, "gradient")
+        self.pressure = None if pressure is None else \
+            self.intervals(pressure, "pressure")
+        self.m = float(m)
+        self.name = name
+
+        # temperature and pressure increase down to the top of each interval
+        self.dT = self.integrate(self.gradient)
+        self.dP = None if pressure is None else self.integrate(self.pressure)
+
+    def intervals(self, values, label):
+        values = np.broadcast_to(np.asarray(values, dtype=float), 
+                                 np.shape(values) or self.depths.shape)
+        if values.shape != self.depths.shape:
+            raise ValueError("Setting %s needs one value per interval (%d)" 
+                             % (label, len(self.depths)))
+        return values
+
+    def integrate(self, gradient):
+        return np.concatenate([[0.], np.cumsum(gradient[:-1]*np.diff(self.depths))])
+
+    def increase(self, depth, total, gradient):
+
+        # increase from the surface to each depth of a piecewise linear profile
+        k = np.maximum(np.searchsorted(self.depths, depth, side="right") - 1, 0)
+        return total[k] + gradient[k]*(depth - self.depths[k])
+
+    def pt(self, depth, tsurf):
+
+        # Temperature (K) and pressure (MPa) for an array of depths (km)
+        depth = np.asarray(depth, dtype=float)
+
+        temp = self.increase(depth, self.dT, self.gradient) + tsurf 
+        if self.pressure is None:
+            # calculate graph intercept from tsurf
+            C = -1*tsurf*self.m
+            pressure = self.m*temp + C
+        else:
+            pressure = 0.101325 + self.increase(depth, self.dP, self.pressure)
+
         # pressure !<0, set surface pressure = 1 atm = 0.10325 MPa     
-        if pressure < 0.101325:
-            pressure = 0.101325
-        
-        
-        return setting, temp + 273.15, pressure  # return temperature in kelvin, 
-                                                 # pressure in MPa   
-                                                 
+        pressure = np.where(pressure < 0.101325, 0.101325, pressure)
+
+        return temp + 273.15, pressure
+
+    def params(self):
+        # Everything the profile depends on, e.g. for keying cached results
+        return (self.gradient.tolist(), self.m, 
+                None if self.pressure is None else self.pressure.tolist(), 
+                self.depths.tolist())
+
+    def __repr__(self):
+        return "Setting(%s)" % (self.name,)
+
 ###############################################################################
                                                  
 class Fluid:
 
-    def Name(fluid):    
+    # Pure fluids are listed in data/fluids.csv, one row per fluid with the
+    # molecular weight (g/mol), Tc (K), Pc (Pa), acentric factor and Vc 
+    # (m^3/kmol). Add a row to make a new fluid available
 
-        if fluid == "H2":
-            name = ChemicalConstantsPackage(MWs=[2.016], names=['H2'], omegas=[-0.2150], 
-                                          Pcs=[1.313e6], Tcs=[33.18])            
-            Vc = [0.0642/1000]
+    def Load():
 
-        elif fluid == "H2O":
-            name = ChemicalConstantsPackage(MWs=[18.015], names=['H2O'], omegas=[0.3449], 
-                                           Pcs=[22.055e6], Tcs=[647.13]) 
-            Vc = [0.0560/1000]
+        header_list = ["Fluid", "MW", "Tc", "Pc", "omega", "Vc"]
+        fluids = pd.read_csv(FLUIDS_CSV, names=header_list)
 
-        return name, Vc
+        _fluids.clear()
+        _fluids_kij.clear()
+        for row in fluids.itertuples(index=False):
+            name = ChemicalConstantsPackage(MWs=[row.MW], names=[row.Fluid], 
+                                            omegas=[row.omega], Pcs=[row.Pc], 
+                                            Tcs=[row.Tc])
+            _fluids[row.Fluid] = (name, (row.Vc/1000,))
 
+    def Name(fluid):
 
+        # Constants package and critical volume (m^3/mol) of a fluid, shared by
+        # all callers so they must not be modified
+        if not _fluids:
+            Fluid.Load()
 
+        if fluid not in _fluids:
+            raise ValueError("Unknown fluid %r, choose from %s or add it to %s"
+                             % (fluid, ", ".join(_fluids), FLUIDS_CSV))
 
+        return _fluids[fluid]
 
+    def Fluids():
+        # Names of the available fluids
+        if not _fluids:
+            Fluid.Load()
 
+        return list(_fluids)
 
+    def Kij(fluids):
 
+        # Binary interaction parameters of a list of fluids from data/kij.csv 
+        # as a nested list, 0 for pairs not in the file
+        if "kij" not in _fluids_kij:
+            kij = pd.read_csv(KIJ_CSV, names=["i", "j", "kij"])
+            _fluids_kij["kij"] = {frozenset((row.i, row.j)): row.kij 
+                                  for row in kij.itertuples(index=False)}
+        pairs = _fluids_kij["kij"]
 
-                                          
\ No newline at end of file
+        return [[0. if i == j else float(pairs.get(frozenset((a, b)), 0.)) 
+                 for j, b in enumerate(fluids)] for i, a in enumerate(fluids)]
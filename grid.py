@@ -0,0 +1,181 @@
+# Fluid mobility over gridded (2D/3D) basin models
+# Bhavik Harish Lodhia
+
+import os
+import json
+import numpy as np
+import data
+import permeability
+import mobility
+import output
+
+# Output fields and the Mobility.Profile column each one is taken from
+FIELDS = {"vmax": "vmax",                   # m/year
+          "mobility": "mob_v",              # m^2/Pa s
+          "density": "rho",                 # kg/m^3
+          "viscosity": "mu",                # Pa s
+          "buoyancy": "buoyancy",           # kg/m^2 s^2
+          "porosity": "porosity",           # fraction
+          "T": "T",                         # K
+          "P": "P"}                         # Pa
+
+###############################################################################
+
+class Grid:
+
+    # Mobility for every cell of a basin grid. depth (km) and lithology
+    # (integer rock ids, see data.ROCKS) are arrays of any shape, typically
+    # memory-mapped .npy files, and tsurf and setting are a value per cell or
+    # one value for the whole grid. Cells are evaluated in chunks of chunk
+    # cells, so the grid never has to fit in memory, e.g.
+    #
+    #   fields = Grid.Run("H2", "lithology.npy", "depth.npy", tsurf=15.,
+    #                     out="h2_grid")
+    #   fields["vmax"]               # memory-mapped h2_grid/vmax.npy
+    #
+    # Basin models have few lithologies and usually repeat the same depths
+    # (layers or a regular vertical grid), so the fluid properties are solved
+    # once per distinct (depth, tsurf, setting) and the rock properties once
+    # per distinct (lithology, depth) in a chunk. Cells with a negative
+    # lithology id or NaN depth (no data) and cells of lithologies without
+    # Holmes (2009) constants (shales, coals and volcanics) are NaN
+
+    def Run(fluid, lithology, depth, tsurf=20., setting=3, eos="PR78", out=None,
+            fields=("vmax", "mobility", "density", "viscosity"), chunk=2**20,
+            water="eos"):
+
+        # Returns a dict of output arrays, one per field, with the shape of
+        # the grid: memory-mapped .npy files in the directory out, or arrays
+        # in memory with out=None
+        for field in fields:
+            if field not in FIELDS:
+                raise ValueError("Unknown grid field %r, choose from %s"
+                                 % (field, ", ".join(FIELDS)))
+        lithology = Grid.Open(lithology)
+        depth = Grid.Open(depth)
+        if lithology.shape != depth.shape:
+            raise ValueError("Lithology and depth grids must have the same shape, "
+                             "not %s and %s" % (lithology.shape, depth.shape))
+        if lithology.dtype.kind not in "iu":
+            raise ValueError("Lithology grid must hold integer rock ids")
+
+        # per cell inputs, flattened views of the grids
+        cells = {"lithology": lithology.reshape(-1), "depth": depth.reshape(-1)}
+        if isinstance(tsurf, (str, os.PathLike)) or np.ndim(tsurf):
+            tsurf = Grid.Open(tsurf)
+            if tsurf.shape != depth.shape:
+                raise ValueError("tsurf must be one value or one per grid cell")
+            cells["tsurf"] = tsurf.reshape(-1)
+        if isinstance(setting, (str, os.PathLike)) or np.ndim(setting):
+            setting = Grid.Open(setting)
+            if setting.shape != depth.shape:
+                raise ValueError("setting must be one value or one per grid cell")
+            cells["setting"] = setting.reshape(-1)
+        else:
+            data.Data.Setting(setting)
+
+        fields = list(fields)
+        results = Grid.Fields(fields, depth.shape, out)
+        targets = [results[field].reshape(-1) for field in fields]
+
+        for s in range(0, depth.size, chunk):
+            e = min(s + chunk, depth.size)
+            part = {name: np.asarray(values[s:e]) for name, values in cells.items()}
+            cols = Grid.Chunk(fluid, part["lithology"], part["depth"].astype(float),
+                              part.get("tsurf", tsurf), part.get("setting", setting),
+                              eos, water)
+            for field, target in zip(fields, targets):
+                target[s:e] = cols[FIELDS[field]]
+
+        if out is not None:
+            for field in fields:
+                results[field].flush()
+            meta = {"software": "hydrogen_mobility",
+                    "version": output.Output.Version(), "code": output.Output.Code(),
+                    "inputs": output.Output.Inputs(), "fluid": fluid, "eos": eos,
+                    "water": water, "shape": list(depth.shape), "fields": fields,
+                    "tsurf": "grid" if "tsurf" in cells else tsurf,
+                    "setting": "grid" if "setting" in cells else setting}
+            with open(os.path.join(out, "grid.json"), "w") as f:
+                json.dump(meta, f, indent=1, default=str)
+
+        return results
+
+    def Open(values):
+
+        # Memory-mapped array for a .npy path, numpy arrays as they are
+        if isinstance(values, (str, os.PathLike)):
+            return np.load(values, mmap_mode="r")
+        return np.asanyarray(values)
+
+    def Fields(fields, shape, out):
+
+        # Output arrays, .npy files opened for writing in the directory out
+        if out is None:
+            return {field: np.full(shape, np.nan) for field in fields}
+
+        os.makedirs(out, exist_ok=True)
+        return {field: np.lib.format.open_memmap(os.path.join(out, field + ".npy"),
+                                                 mode="w+", dtype=float, shape=shape)
+                for field in fields}
+
+###############################################################################
+
+    def Chunk(fluid, rows, depth, tsurf, setting, eos, water="eos"):
+
+        # Mobility.Profile columns (without uncertainties) for a chunk of
+        # cells, solving each distinct fluid and rock state once
+        n = len(depth)
+        valid = (rows >= 0) & (rows < len(data.ROCKS)) & np.isfinite(depth)
+        valid[valid] = np.isfinite(permeability.Profile.Holmes(rows[valid], False)[0])
+
+        cols = {field: np.full(n, np.nan) for field in FIELDS.values()}
+        if not valid.any():
+            return cols
+        rows, depth = rows[valid].astype(np.intp), depth[valid]
+        tsurf = np.broadcast_to(np.asarray(tsurf, dtype=float), n)[valid]
+
+        # distinct values of each input as integer codes, combined into one
+        # integer key per state (faster than np.unique over rows of floats)
+        depths, d = np.unique(depth, return_inverse=True)
+        tsurfs, t = np.unique(tsurf, return_inverse=True)
+        if isinstance(setting, np.ndarray):
+            settings, c = np.unique(np.asarray(setting)[valid], return_inverse=True)
+            settings = [int(value) for value in settings]
+        else:
+            settings, c = [setting], np.zeros(len(depth), dtype=np.intp)
+
+        # fluid properties per distinct depth, surface temperature and setting
+        keys, inverse = np.unique((c*len(tsurfs) + t)*len(depths) + d,
+                                  return_inverse=True)
+        fluid_cols = None
+        for i, value in enumerate(settings):
+            sel = keys // (len(tsurfs)*len(depths)) == i
+            if not sel.any():
+                continue
+            code = keys[sel] % (len(tsurfs)*len(depths))
+            part = mobility.Mobility.Fluid(fluid, depths[code % len(depths)],
+                                           tsurfs[code // len(depths)], eos, water,
+                                           value)
+            if fluid_cols is None:
+                fluid_cols = {key: np.empty(len(keys), dtype=np.asarray(v).dtype)
+                              for key, v in part.items()}
+            for key, v in part.items():
+                fluid_cols[key][sel] = v
+        fluid_cols = {key: v[inverse.reshape(-1)] for key, v in fluid_cols.items()}
+
+        # rock properties per distinct lithology and depth, without the rock
+        # profile cache: the states of a chunk are rarely seen again and would
+        # only fill it
+        keys, inverse = np.unique(rows*len(depths) + d, return_inverse=True)
+        rock_cols = permeability.Profile.State(keys // len(depths), 
+                                               depths[keys % len(depths)],
+                                               uncertainty=False)
+        rock_cols = {key: np.asarray(v)[inverse.reshape(-1)] 
+                     for key, v in rock_cols.items()}
+
+        prof = mobility.Mobility.Velocity(rock_cols, fluid_cols, uncertainty=False)
+        for field in FIELDS.values():
+            cols[field][valid] = prof[field]
+
+        return cols
@@ -5,340 +5,572 @@
 import data
 import permeability
 import viscosity
-from uncertainties import ufloat
+import output as results
+import plotting
+import itertools
+import cache
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from dataclasses import dataclass
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+
+@dataclass(frozen=True)
+class Point:
+
+    # Mobility.Mobility result for one fluid, rock and depth. mob_v and mob_h
+    # are the vertical and horizontal mobilities (m^2/Pa s, *_uc their 
+    # uncertainties) of the liquid for 'l' and 'l/g' states and of the gas 
+    # for 'g' states; the gas mobilities of 'l/g' states are in the *_g 
+    # fields. Quantities of a phase that is not present are NaN
+    fluid: str
+    rock: str                   # name in data.ROCKS, also for rock ids
+    EOS: str
+    depth: float
+    tsurf: float
+    phase: str                  # 'l', 'g' or 'l/g'
+    P: float                    # Pa
+    T: float                    # K
+    mob_v: float
+    mob_v_uc: float
+    mob_h: float
+    mob_h_uc: float
+    mob_v_g: float
+    mob_v_g_uc: float
+    mob_h_g: float
+    mob_h_g_uc: float
+    mu_l: float                 # Pa s
+    mu_g: float
+    V_l: float                  # m^3/mol
+    V_g: float
+    rho_l: float                # kg/m^3
+    rho_g: float
+
+    @property
+    def mu(self):
+        # viscosity the mobility is based on
+        return self.mu_g if self.phase == 'g' else self.mu_l
+
+    @property
+    def rho(self):
+        # fluid density, gas density for 'l/g' states
+        return self.rho_l if self.phase == 'l' else self.rho_g
+
 
 class Mobility:
     
     # Calculate fluid mobility as a function of depth
-    def Mobility(Fluid, rock, depth, tsurf, EOS):
-    
-        name, Vc = data.Fluid.Name(Fluid)
-            
-        # calculate porosity using Athy (1930)
-        por = permeability.Permeability.Porosity(rock, depth)
-    
-        # calculate rock permeability using multipoint method (Hantschel 2009)
-        kv, kh = permeability.Permeability.k("multipoint", rock, por)      
-        # calculate connate water saturation using Holmes (2009)
-        SW = permeability.Permeability.SwiZ(rock, depth)
-            
-        # extract values and uncertainties
-        Sw = SW[2].n                            # Sw value as float
-        Swuc = SW[2].s                          # Sw uncertainty as float
-    
-        # relative water-liquid permeability with uncertainties
-        krel = permeability.Permeability.krp(rock, "Quadratic", "WL", ufloat(Sw, Swuc)) 
-            
-        # extract values and uncertainties
-        kr = krel[1].n                          # relative perm water
-        kr_uc = krel[1].s                       # relative perm water error
-        krow = krel[2].n                        # relative perm oil-water
-        krow_uc = krel[2].s                     # relative perm oil-water error
-  
-        mD = 9.869233e-15                       # conversion from mD to m^2
-    
-        # Kveff = 10**(kv) * mD * ufloat(kr, kr_uc)
-        # kveff = Kveff.n
-        # kveff_uc = Kveff.s
-        # Kheff = 10**(kv) * mD * ufloat(kr, kr_uc)
-        # kheff = Kheff.n
-        # kheff_uc = Kheff.s    
-        # return kveff, kveff_uc, kheff, kheff_uc
-    
-        ############
-        # relative water-liquid permeability with uncertainties
-        krell = permeability.Permeability.krp(rock, "Quadratic", "VL", ufloat(Sw, Swuc)) 
-    
-    # extract values and uncertainties
-        krg = krell[1].n                         # relative perm water
-        krg_uc = krell[1].s                      # relative perm water error
-        krog = krell[2].n                        # relative perm oil-water
-        krog_uc = krell[2].s                     # relative perm oil-water error   
-    
-        # Aziz and Settari (1979) approximation - phases do not interact
-        Kro = ufloat(krow, krow_uc)*ufloat(krog, krog_uc)
-        kro = Kro.n
-        kro_uc = Kro.s
+    def Mobility(Fluid, rock, depth, tsurf, EOS, setting=3):
 
-        # use oil-water permeability for vertical and horizontal keffs
-        Kveff = 10**(kv) * mD * ufloat(kro, kro_uc)
-        kveff = Kveff.n
-        kveff_uc = Kveff.s    
-        Kheff = 10**(kh) * mD * ufloat(kro, kro_uc)
-        kheff = Kheff.n
-        kheff_uc = Kheff.s
-        #############
-       
-        # calculate temperature and pressure from depth for normal geological
-        # conditions
-        
-        pt = data.Data.PT(3, depth, tsurf)
+        # temperature and pressure from depth for the geological setting, a
+        # number from data.SETTINGS or a data.Setting
+        pt = data.Data.PT(setting, depth, tsurf)
         T = pt[1]                               # temperature in kelvin
         P = pt[2]*1e6                           # *1e6 for pressure in Pa
 
-        #print(T,P)  
-
-            # ViscosityPure changed to include mu_l and mu_g on 27/07/21!
-        if len(name.MWs) == 1 and name != "H2O":
-            visc = viscosity.Viscosity.Pure(name, EOS, Vc, T, P)
-            phase = visc[2]
-            mul = visc[8]
-            mug = visc[9]
-            rhol = visc[11]
-            rhog = visc[13]
-            p = visc[4]
-            t = visc[5]
-            v_L = visc[6]
-            v_G = visc[7]
-            # print(phase, rhol, rhog)
-            # return depth, T, P, mu, rhol, rhog
-    
-        elif len(name.MWs) == 1 and name == "H2O":
-            visc = viscosity.Viscosity.Pure(name, EOS, Vc, T, P)
-            phase = visc[2]
-            mul = visc[8]
-            mug = visc[9]
-            rhol = visc[11]
-            rhog = visc[13]
-            p = visc[4]
-            t = visc[5]     
-   
-        if phase == 'l/g':
-            # verticql velocity (liquid)
-            mob_vl = 1*(ufloat(kveff, kveff_uc)/mul) # -1 omitted
-            # horizontal velocity (liquid)
-            mob_hl = 1*(ufloat(kheff, kheff_uc)/mul) # -1 omitted          
-            # vertical velocity (gas)
-            mob_vg = 1*(ufloat(kveff, kveff_uc)/mug) # -1 omitted      
-            # horizontal velocity (gas)
-            mob_hg = 1*(ufloat(kheff, kheff_uc)/mug) # -1 omitted
-            return Fluid, rock, EOS, depth, tsurf, phase, p, t, mob_vl.n, mob_vl.s, \
-                mob_hl.n, mob_hl.s, mob_vg.n, mob_vg.s, mob_hg.n, mob_hg.s, \
-                mul, mug, v_L, v_G, rhol, rhog
-               
-        elif phase == 'l':
-            # vertical mobility
-            mob_vl = 1*(ufloat(kveff, kveff_uc)/mul) # -1 omitted
-            #horizontal velocity
-            mob_hl = 1*(ufloat(kheff, kheff_uc)/mul) # -1 omitted      
-            return Fluid, rock, EOS, depth, tsurf, phase, p, t, mob_vl.n, mob_vl.s, \
-                mob_hl.n, mob_hl.s, mul, v_L, rhol
-
-        elif phase == 'g':
-            # vertical velocity
-            mob_vg = 1*(ufloat(kveff, kveff_uc)/mug) # -1 omitted    
-            # horizontal velocity
-            mob_hg = 1*(ufloat(kheff, kheff_uc)/mug) # -1 omitted    
-            return Fluid, rock, EOS, depth, tsurf, phase, p, t, mob_vg.n, mob_vg.s, \
-                mob_hg.n, mob_hg.s, mug, v_G, rhog        
-
-class Run:
-
-    def run(fluid, rock, depth, tsurf, setting, eos, output, plot, save):
-
-        #depths = []
-        mobs = []
-        rhows = []
-        buoys = []
-        vels = []
-        dens = []
-        viscs = []        
-
-        for z in depth:
-    
-            mob = Mobility.Mobility(fluid, rock, z, tsurf, eos)
-            rhow = Mobility.Mobility("H2O", rock, z, tsurf, eos)
-            density = mob[-1]
-            mobb = mob[8]
-
-            pt = data.Data.PT(setting, z, tsurf)
-            T = pt[1]                               # temperature in kelvin
-            P = pt[2]*1e6                           # *1e6 for pressure in Pa
-
-            name = data.Fluid.Name(fluid)[0]
-            Vc = data.Fluid.Name(fluid)[1]
-            mu = viscosity.Viscosity.Pure(name, eos, Vc, T, P)
-            if mu[2] == 'g':
-                visc = mu[9] 
-            elif mu[2] == 'l':
-                visc = mu[8]
-            elif mu[2] == 'l/g':
-                visc = mu[8] # choose liquid viscosity in case of 'l/g' phase
-            
-            
-            
-            # correct to ensure liquid density is chosen for  case of l/g phase
-            if rhow[5] == 'l/g':
-                rhow = rhow[-2]
-            elif rhow[5] != 'l/g':
-                rhow = rhow[-1]
-
-            buoy = 9.08665*(rhow - mob[-1])
-            vel = mob[8]*buoy*3.154e7 # multiply by 3.154e7 s in a year
-
-            #if output == "on":     
-            
-                #print(str("------------ Mobility algothm results ------------------------"))
-                #print(str("Fluid ="), fluid, str("rock ="), rock, str("at depth ="), z, str("km"))
-                #print(str("Mobility ="), mob[8], str("= m^2/PaS"))
-                #print(str("Water density ="), rhow, str("kg/m^3"))
-                #print(str("Fluid density ="), mob[-1], str("kg/m^3"))
-                #print(str("Fluid viscosity = "), visc, str("Pas"))
-                #print(str("Buoyancy ="),buoy,str("kg/m^2s^2"))
-                #print(str("Vertical velocity ="), vel, str("m/year"), str("kg/m^3"))
-                #print(str("---------------------------------------------------------------"))
-                
-            mobs.append(mobb)
-            rhows.append(rhow)
-            buoys.append(buoy)
-            vels.append(vel)
-            dens.append(density)
-            viscs.append(visc)
-
-        # Multiply viscosity by 10e5 for display
+        return Mobility.At(Fluid, rock, depth, tsurf, EOS, T, P)
 
-        viscss = [x * 10e5 for x in viscs] 
+    def At(Fluid, rock, depth, tsurf, EOS, T, P, rock_state=None):
 
-        if output == "on":
-            dict = {'Depth [km]':depth,'Density [km/m^3]':dens, 'Buoyancy [kg/m^2s^s]':buoys, 'Viscosity [x10^-5 Pas]':viscss,'vmax [m/year]':vels}
-            #print(dict)
-            #dict = {'Depth':depth}
-            df = pd.DataFrame(dict)
-            print("Mobility algorithm results for", fluid, "and", rock)
-            print(df)
-
-            if save == "true":
-                df.to_csv('output.csv', index=False)
+        # Mobility.Mobility at a given temperature (K) and pressure (Pa). 
+        # rock_state (kv, kh, kro and kro_uc of permeability.Profile.Rock at 
+        # this rock and depth) skips the rock calculation when it is shared
+        # between fluids
+        name, Vc = data.Fluid.Name(Fluid)
 
-            elif save == "false":
-                pass
+        # porosity (Athy 1930), multipoint permeability (Hantschel 2009), 
+        # connate water saturation (Holmes 2009) and relative permeabilities 
+        # with first order uncertainties, see permeability.Profile
+        if rock_state is None:
+            rock_state = permeability.Profile.Rock(rock, depth)
+        kv = float(rock_state["kv"])
+        kh = float(rock_state["kh"])
+        kro = float(rock_state["kro"])
+        kro_uc = float(rock_state["kro_uc"])
 
-        elif output == "off":
-            pass
+        mD = 9.869233e-15                       # conversion from mD to m^2
 
+        # use oil-water permeability for vertical and horizontal keffs
+        kveff = 10**(kv) * mD * kro
+        kveff_uc = 10**(kv) * mD * kro_uc
+        kheff = 10**(kh) * mD * kro
+        kheff_uc = 10**(kh) * mD * kro_uc
+
+        visc = viscosity.Viscosity.Pure(name, EOS, Vc, T, P)
+
+        # vertical and horizontal mobility, 1*(k/mu), -1 omitted. Liquid 
+        # viscosity for 'l' and 'l/g', gas viscosity for 'g' and the gas
+        # mobilities of 'l/g' states
+        mu = visc.mu_g if visc.phase == 'g' else visc.mu_l
+        mug = visc.mu_g if visc.phase == 'l/g' else float('nan')
+
+        return Point(Fluid, data.ROCKS[data.Data.Name(rock)][0], EOS, depth, tsurf,
+                     visc.phase, visc.P, visc.T,
+                     kveff/mu, kveff_uc/mu, kheff/mu, kheff_uc/mu,
+                     kveff/mug, kveff_uc/mug, kheff/mug, kheff_uc/mug,
+                     visc.mu_l, visc.mu_g, visc.V_l, visc.V_g, 
+                     visc.rho_l, visc.rho_g)
+
+    # Calculate fluid mobility for a whole depth profile at once
+    def Profile(Fluid, rock, depth, tsurf, EOS, uncertainty=True, water="eos",
+                setting=3):
+
+        # Vectorized Mobility.Mobility for a numpy array of depths (km). rock is
+        # a rock name/id or an array of rock ids, one per depth. Returns a dict 
+        # of columns including vmax (m/year) as calculated by Run.run. As in 
+        # Mobility.Mobility, liquid viscosity is used for 'l/g' states and the
+        # reported density is the gas density for 'l/g' states.
+        # uncertainty=False skips the uncertainty (_uc) columns for nominal-only
+        # runs, water selects the water density model (see viscosity.Water)
+        # and setting the geological setting (see data.Data.Setting)
+        depth = np.asarray(depth, dtype=float)
+        cols = permeability.Profile.Rock(rock, depth, uncertainty)
+        fluid = Mobility.Fluid(Fluid, depth, tsurf, EOS, water, setting)
+
+        return Mobility.Velocity(cols, fluid, uncertainty)
+
+    def Fluids(fluids, rock, depth, tsurf, EOS, uncertainty=True, water="eos", 
+               setting=3):
+
+        # Mobility.Profile for a list of fluids (e.g. ["H2", "CH4", "CO2"]) 
+        # with the rock properties evaluated once for all of them. Returns a 
+        # dict of Mobility.Profile columns per fluid
+        depth = np.asarray(depth, dtype=float)
+        cols = permeability.Profile.Rock(rock, depth, uncertainty)
+
+        return {fluid: Mobility.Velocity(cols, Mobility.Fluid(fluid, depth, tsurf, 
+                                                              EOS, water, setting), 
+                                         uncertainty)
+                for fluid in fluids}
+
+    def Velocity(cols, fluid, uncertainty=True):
+
+        # Combine the rock columns of permeability.Profile.Rock with the fluid
+        # columns of Mobility.Fluid into the Mobility.Profile columns, so one
+        # rock profile can be reused for several fluids or settings
+        mD = 9.869233e-15                       # conversion from mD to m^2
 
-        if output == "on" and plot == "vmax":
+        cols = dict(cols)
+        mu = fluid["mu"]
         
-            # Plotting
-            plt.figure(figsize=(8, 6))
-            plt.scatter(vels, depth)
-            # plot.plot(vels, depth) # plot as line
-
-            plt.ylim(0, max(depth)+ 0.5)  # Depth range from 0 to 4 km
-            plt.xlim(0, max(vels) + 2)  # X-axis range from 0 to 2 units greater than the largest velocity
-            plt.gca().invert_yaxis()
-
-            
-            plt.xlabel('Vertical Velocity [m/year]')
-            plt.ylabel('Depth [km]')
-            plt.title('Vertical Velocity vs. Depth')
-            plt.grid(True)
-
-            plt.show()
-
-            if save == "true":
-                plt.savefig('output.png')
-            else:
-                pass               
-
-        elif output == "on" and plot == "mobility":
-             # Plotting
-            plt.figure(figsize=(8, 6))
-            plt.scatter(mobs, depth)
-            # plot.plot(vels, depth) # plot as line
-
-            plt.ylim(0, max(depth)+ 0.5)  # Depth range from 0 to 4 km
-            plt.xlim(0, max(mobs) + 1e-13)  # X-axis range from 0 to 1e-5 units greater than the largest viscosity
-            plt.gca().invert_yaxis()
-
-            
-            plt.xlabel('Fluid mobility [m^2/Pas]')
-            plt.ylabel('Depth [km]')
-            plt.title('Fluid mobility vs. Depth')
-            plt.grid(True)
+        # use oil-water permeability for vertical and horizontal keffs
+        kveff = 10**cols["kv"] * mD * cols["kro"]
+        kheff = 10**cols["kh"] * mD * cols["kro"]
+        mob_v = kveff/mu
+        
+        cols.update(fluid)
+        cols.update({"kveff": kveff, "kheff": kheff,
+                     "mob_v": mob_v, "mob_h": kheff/mu,
+                     "vmax": mob_v*fluid["buoyancy"]*3.154e7})  # 3.154e7 s in a year
+        if uncertainty:
+            kveff_uc = 10**cols["kv"] * mD * cols["kro_uc"]
+            kheff_uc = 10**cols["kh"] * mD * cols["kro_uc"]
+            cols.update({"kveff_uc": kveff_uc, "kheff_uc": kheff_uc,
+                         "mob_v_uc": kveff_uc/mu, "mob_h_uc": kheff_uc/mu})
+
+        return cols
+
+    def Fluid(Fluid, depth, tsurf, EOS, water="eos", setting=3):
+
+        # Rock independent part of Mobility.Profile: temperature (K), pressure 
+        # (Pa), phase, viscosity, density, water density and buoyancy along an 
+        # array of depths (km) for a geological setting
+        name, Vc = data.Fluid.Name(Fluid)
 
-            plt.show() 
+        T, P = data.Data.PTArray(setting, depth, tsurf)
+        P = P*1e6                               # *1e6 for pressure in Pa
 
-            if save == "true":
-                plt.savefig('output.png')
-            else:
-                pass   
+        visc = viscosity.Viscosity.Profile(name, EOS, Vc, T, P)
+        phase = visc["phase"]
+        mu = np.where(phase == 'g', visc["mu_g"], visc["mu_l"])
+        rho = np.where(phase == 'l', visc["rho_l"], visc["rho_g"])
 
+        rhow = viscosity.Water.Density(T, P, water, EOS)
 
-        elif output == "on" and plot == "buoyancy":
-             # Plotting
-            plt.figure(figsize=(8, 6))
-            plt.scatter(buoys, depth)
-            # plot.plot(vels, depth) # plot as line
+        return {"T": T, "P": P, "phase": phase, "mu": mu, "rho": rho, 
+                "rhow": rhow, "buoyancy": 9.08665*(rhow - rho)}
 
-            plt.ylim(0, max(depth)+ 0.5)  # Depth range from 0 to 4 km
-            plt.xlim(0, max(buoys) + 50)  # X-axis range from 0 to 50 units greater than the largest buoyancy
-            plt.gca().invert_yaxis()
+class Run:
 
+    def CacheConfig(path=None, maxbytes=2**30):
+
+        # On-disk cache of Run.sweep and Run.stream results (None switches it
+        # off): a SQLite database at path, shared by worker processes and 
+        # later runs and kept below maxbytes. Results are stored per fluid, 
+        # EOS, surface temperature, setting and rock, keyed on the fluid 
+        # constants, the parameters of that rock, the depths, the source of
+        # the calculating modules and whether property tables are used (see
+        # Viscosity.Mode), so re-running a study with one changed rock only 
+        # calculates that rock
+        if _results["store"] is not None:
+            _results["store"].close()
+        _results["store"] = cache.Store(path, maxbytes) if path is not None else None
+
+    def CacheInfo():
+        # hits, misses, entries and size of the result cache
+        return _results["store"].info() if _results["store"] is not None else None
+
+    def CacheClear():
+        if _results["store"] is not None:
+            _results["store"].clear()
+
+    def run(fluid, rock, depth, tsurf, setting, eos, output, plot, save, water="eos",
+            path="output", show=False):
+
+        # save == "true" writes the table to path + ".csv" and the plot to 
+        # path + ".png". Plots are drawn without a display unless show=True.
+        # setting is a number from data.SETTINGS or a data.Setting; 
+        # temperature and pressure are calculated once for all depths and 
+        # used for the mobility, density, viscosity and water density
+
+        # fluid is a fluid name or a list of them; the rock properties and 
+        # water density are then calculated once per depth for all fluids, 
+        # a table is printed (and saved to path + "_" + fluid + ".csv") per 
+        # fluid and the fluids are plotted together
+        fluids = [fluid] if isinstance(fluid, str) else list(fluid)
+        for name in fluids:
+            data.Fluid.Name(name)
+
+        temps, pressures = data.Data.PTArray(setting, depth, tsurf)
+        rocks = permeability.Profile.Rock(rock, np.asarray(depth, dtype=float))
+
+        # water density at the same conditions (liquid density in case of 
+        # l/g phase), see viscosity.Water
+        rhows = [viscosity.Water.Density(T, P*1e6, water, eos) 
+                 for T, P in zip(temps.tolist(), pressures.tolist())]
+
+        frames = []
+        for fluid in fluids:
+
+            #depths = []
+            mobs = []
+            buoys = []
+            vels = []
+            dens = []
+            viscs = []        
+
+            for i, (z, T, P) in enumerate(zip(depth, temps.tolist(), pressures.tolist())):
+    
+                # *1e6 for pressure in Pa
+                rock_state = {key: rocks[key][i] for key in ("kv", "kh", "kro", "kro_uc")}
+                mob = Mobility.At(fluid, rock, z, tsurf, eos, T, P*1e6, rock_state)
+                density = mob.rho
+                mobb = mob.mob_v
+                # liquid viscosity in case of 'l/g' phase
+                visc = mob.mu
+
+                buoy = 9.08665*(rhows[i] - mob.rho)
+                vel = mob.mob_v*buoy*3.154e7 # multiply by 3.154e7 s in a year
+
+                #if output == "on":     
             
-            plt.xlabel('Buoyancy [kg/m^2s^2]')
-            plt.ylabel('Depth [km]')
-            plt.title('Buoyancy vs. Depth')
-            plt.grid(True)
-
-            plt.show()   
-
-            if save == "true":
-                plt.savefig('output.png')
-            else:
-                pass   
-
-        elif output == "on" and plot == "density":
-             # Plotting
-            plt.figure(figsize=(8, 6))
-            plt.scatter(dens, depth)
-            # plot.plot(vels, depth) # plot as line
-
-            plt.ylim(0, max(depth)+ 0.5)  # Depth range from 0 to 4 km
-            plt.xlim(0, max(dens) + 5)  # X-axis range from 0 to 5 units greater than the largest density
-            plt.gca().invert_yaxis()
-
-            if save == "true":
-                plt.savefig('output.png')
-            else:
-                pass   
-            
-            plt.xlabel('Fluid density [kg/m^3]')
-            plt.ylabel('Depth [km]')
-            plt.title('Fluid density vs. Depth')
-            plt.grid(True)
-
-            plt.show()    
+                    #print(str("------------ Mobility algothm results ------------------------"))
+                    #print(str("Fluid ="), fluid, str("rock ="), rock, str("at depth ="), z, str("km"))
+                    #print(str("Mobility ="), mob.mob_v, str("= m^2/PaS"))
+                    #print(str("Water density ="), rhow, str("kg/m^3"))
+                    #print(str("Fluid density ="), mob.rho, str("kg/m^3"))
+                    #print(str("Fluid viscosity = "), visc, str("Pas"))
+                    #print(str("Buoyancy ="),buoy,str("kg/m^2s^2"))
+                    #print(str("Vertical velocity ="), vel, str("m/year"), str("kg/m^3"))
+                    #print(str("---------------------------------------------------------------"))
+                
+                mobs.append(mobb)
+                buoys.append(buoy)
+                vels.append(vel)
+                dens.append(density)
+                viscs.append(visc)
 
-            if save == "true":
-                plt.savefig('output.png')
-            else:
-                pass               
+            # Multiply viscosity by 10e5 for display
 
-        elif output == "on" and plot == "viscosity":
-             # Plotting
-            plt.figure(figsize=(8, 6))
-            plt.scatter(viscs, depth)
-            # plot.plot(vels, depth) # plot as line
+            viscss = [x * 10e5 for x in viscs] 
 
-            plt.ylim(0, max(depth)+ 0.5)  # Depth range from 0 to 4 km
-            plt.xlim(0, max(viscs) + 1e-5)  # X-axis range from 0 to 1e-5 units greater than the largest viscosity
-            plt.gca().invert_yaxis()
+            if output == "on":
+                dict = {'Depth [km]':depth,'Density [km/m^3]':dens, 'Buoyancy [kg/m^2s^s]':buoys, 'Viscosity [x10^-5 Pas]':viscss,'vmax [m/year]':vels}
+                #print(dict)
+                #dict = {'Depth':depth}
+                df = pd.DataFrame(dict)
+                print("Mobility algorithm results for", fluid, "and", rock)
+                print(df)
 
-            
-            plt.xlabel('Fluid viscosity [Pas]')
-            plt.ylabel('Depth [km]')
-            plt.title('Fluid density vs. Depth')
-            plt.grid(True)
+                if save == "true":
+                    name = path if len(fluids) == 1 else path + '_' + fluid
+                    df.to_csv(name + '.csv', index=False)
 
-            plt.show()           
+                elif save == "false":
+                    pass
 
-            if save == "true":
-                plt.savefig('output.png')
-            else:
-                pass             
+            elif output == "off":
+                pass
 
-        elif plot == "off":
-            pass
\ No newline at end of file
+            frames.append(pd.DataFrame({"fluid": fluid, "depth": depth, "vmax": vels, 
+                                        "mobility": mobs, "buoyancy": buoys, 
+                                        "density": dens, "viscosity": viscs}))
+
+        if output == "on" and plot != "off":
+            frame = pd.concat(frames, ignore_index=True)
+            by = "fluid" if len(fluids) > 1 else None
+            if show:
+                # interactive window, saved before it is shown
+                import matplotlib.pyplot as plt
+                fig = plt.figure(figsize=(8, 6))
+                fig.subplots(1, 1, squeeze=False)
+                _plotter.draw(fig, frame, [plot], by)
+                if save == "true":
+                    fig.savefig(path + '.png')
+                plt.show()
+            elif save == "true":
+                # saved on the plotter's thread (see plotting.Plotter) and
+                # waited for, so the file is complete when Run.run returns
+                _plotter.plot(frame, plot, by, path + '.png')
+                _plotter.wait()
+            elif plot not in plotting.PLOTS:
+                raise ValueError("Unknown plot variable %r, choose from %s or 'off'"
+                                 % (plot, ", ".join(plotting.PLOTS)))
+
+    def sweep(fluids, rocks, depth, tsurfs=(20.,), settings=(3,), eoss=("PR78",), 
+              workers=None, chunksize=None, uncertainty=True, water="eos",
+              out=None, format=None, partition_by=("fluid", "eos")):
+
+        # Run.run for every combination of fluids, rocks, geological settings, 
+        # surface temperatures and equations of state over the same depths. 
+        # Returns one tidy DataFrame with a row per combination and depth.
+        # The rock properties are evaluated once for all fluids, EOS and 
+        # surface temperatures and the fluid properties once per setting, so
+        # PT, EOS solves and water density are shared between rocks.
+        # With workers > 1 the (rock, depth) points are split into chunks of
+        # chunksize and evaluated in a process pool; results are identical to
+        # and in the same order as the serial run. uncertainty=False leaves
+        # the mobility uncertainty as NaN, water selects the water density 
+        # model (see viscosity.Water).
+        # With out set to a directory the results are written there in chunks
+        # of chunksize points (default 100000) as they are calculated instead 
+        # of being returned (see Run.stream and output.Writer, format 
+        # "parquet", "npz" or "csv", partitioned by the partition_by columns),
+        # and the dataset metadata is returned
+        if isinstance(fluids, str):
+            fluids = [fluids]
+        if isinstance(rocks, (str, int)):
+            rocks = [rocks]
+        
+        depth = np.asarray(depth, dtype=float)
+        sweep = {"fluids": list(fluids), "rocks": [str(r) for r in rocks],
+                 "depths": {"count": len(depth), 
+                            "min": float(depth.min()) if len(depth) else None,
+                            "max": float(depth.max()) if len(depth) else None},
+                 "tsurfs": list(tsurfs), "settings": list(settings), 
+                 "eoss": list(eoss), "uncertainty": uncertainty, "water": water}
+
+        if out is not None:
+            # written chunk by chunk as they are calculated, see Run.stream
+            frames = Run.stream(fluids, rocks, depth, tsurfs, settings, eoss, 
+                                chunksize or 100000, workers, uncertainty, water)
+            return _write(out, format, partition_by, frames, sweep)
+
+        if workers is not None and workers > 1:
+            if chunksize is None:
+                points = len(data.Data.Ids(list(rocks)))*len(depth)
+                chunksize = max(1, -(-points // (4*workers)))
+            units = list(_units(fluids, rocks, depth, tsurfs, settings, eoss, 
+                                chunksize, uncertainty, water))
+            pool = _pool(workers)
+            if pool is not None:
+                with pool:
+                    blocks = list(pool.map(_sweep_block, units))
+                # blocks are per chunk with one frame per fluid, EOS, surface
+                # temperature and setting, reorder to put the chunks of each
+                # combination together as in the serial run
+                frames = [block[k] for k in range(len(blocks[0]) if blocks else 0)
+                          for block in blocks]
+                return pd.concat(frames, ignore_index=True)
+
+        frames = Run.stream(fluids, rocks, depth, tsurfs, settings, eoss, None, 
+                            None, uncertainty, water)
+
+        return pd.concat(list(frames), ignore_index=True)
+
+    def stream(fluids, rocks, depth, tsurfs=(20.,), settings=(3,), eoss=("PR78",),
+               chunk=100000, workers=None, uncertainty=True, water="eos"):
+
+        # Run.sweep as a generator of DataFrames with at most chunk rows each
+        # (chunk=None for whole blocks), yielded as soon as they are 
+        # calculated so memory use does not grow with the number of depths or
+        # rocks. Frames come per chunk of (rock, depth) points, whose rock 
+        # properties are calculated once, then per fluid, EOS, surface 
+        # temperature and setting. With workers > 1 chunks are calculated in
+        # a process pool,
+        # at most 2*workers chunks ahead of the consumer. The frames can be 
+        # passed straight on, e.g.
+        #
+        #   with output.Writer("results") as out:
+        #       for frame in Run.stream("H2", rocks, np.linspace(0, 5, 10**6)):
+        #           out.write(frame)
+        units = _units(fluids, rocks, depth, tsurfs, settings, eoss, chunk, 
+                       uncertainty, water)
+        
+        pool = _pool(workers) if workers is not None and workers > 1 else None
+        if pool is None:
+            for unit in units:
+                yield from _sweep_block(unit)
+            return
+
+        with pool:
+            pending = deque()
+            for unit in units:
+                pending.append(pool.submit(_sweep_block, unit))
+                if len(pending) >= 2*workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+
+def _units(fluids, rocks, depth, tsurfs, settings, eoss, chunk, uncertainty, water):
+
+    # Work units of Run.stream: chunks of (rock, depth) points, each for all
+    # fluids, EOS and surface temperatures. Rock ids and depths of a chunk are
+    # built from the point index when needed, never for the whole sweep
+    if isinstance(fluids, str):
+        fluids = [fluids]
+    if isinstance(rocks, (str, int)):
+        rocks = [rocks]
+    depth = np.asarray(depth, dtype=float)
+    ids = data.Data.Ids(list(rocks))
+    n = len(ids)*len(depth)
+    chunk = chunk or max(n, 1)
+
+    for s in range(0, n, chunk):
+        k = np.arange(s, min(s + chunk, n))
+        yield (list(fluids), list(eoss), list(tsurfs), list(settings), 
+               ids[k // len(depth)], depth[k % len(depth)], uncertainty, water)
+
+def _pool(workers):
+    # Process pool for Run.sweep and Run.stream, None without process support
+    try:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(_results["store"],))
+    except (OSError, NotImplementedError):
+        return None
+
+# Shared by Run.run calls so figures are reused
+_plotter = plotting.Plotter()
+
+# Result cache of Run.sweep and Run.stream, see Run.CacheConfig
+_results = {"store": None}
+
+# Columns of Run.sweep that are calculated, the others are labels; in the
+# result cache the phase is stored as an index into PHASES followed by the
+# other columns as one block of floats
+COLUMNS = ("phase", "T", "P", "density", "buoyancy", "viscosity", "mobility", 
+           "mobility_uc", "vmax")
+PHASES = np.array(["l", "g", "l/g"])
+
+def _init_worker(store=None):
+    # load the lithology tables once per worker process and use the result
+    # cache of the parent
+    data.Data.Params()
+    _results["store"] = store
+
+def _write(path, format, partition_by, frames, sweep):
+    # Stream Run.sweep frames to an output.Writer, returns the metadata
+    with results.Writer(path, format, partition_by, {"sweep": sweep}) as out:
+        for frame in frames:
+            out.write(frame)
+    return out.meta
+
+def _sweep_block(unit):
+
+    # Run.sweep results over arrays of rock ids and depths, one DataFrame per
+    # fluid, EOS, surface temperature and setting. The rock properties are
+    # calculated once and shared by all of them, with the result cache only
+    # those of rocks that are not in the cache (see _cached)
+    fluids, eoss, tsurfs, settings, rock_ids, depths, uncertainty, water = unit
+    rock_names = np.array([r[0] for r in data.ROCKS])[rock_ids]
+    rock_cols = None
+    if _results["store"] is None:
+        rock_cols = permeability.Profile.Rock(rock_ids, depths, uncertainty)
+
+    frames = []
+    for fluid, eos, tsurf, setting in itertools.product(fluids, eoss, tsurfs, settings):
+        label = setting.name if isinstance(setting, data.Setting) else setting
+        if _results["store"] is None:
+            cols = _columns(rock_cols, rock_ids, depths, fluid, eos, tsurf, setting, 
+                            uncertainty, water)
+        else:
+            cols = _cached(rock_ids, depths, fluid, eos, tsurf, setting, uncertainty, 
+                           water)
+        frame = {"fluid": fluid, "rock": rock_names, "setting": label,
+                 "tsurf": tsurf, "eos": eos, "depth": depths}
+        frame.update(cols)
+        frames.append(pd.DataFrame(frame))
+    if _results["store"] is not None:
+        _results["store"].flush()
+
+    return frames
+
+def _columns(rock_cols, rock_ids, depths, fluid, eos, tsurf, setting, uncertainty, 
+             water):
+
+    # Calculated Run.sweep columns for one fluid, EOS, surface temperature and
+    # setting, rock_cols from permeability.Profile.Rock or None
+    if rock_cols is None:
+        rock_cols = permeability.Profile.Rock(rock_ids, depths, uncertainty)
+    # everything at the temperature and pressure of the setting, liquid
+    # viscosity for 'l/g' as in Run.run. Chunks repeat the depths once per
+    # rock, so the fluid properties are calculated per distinct depth
+    values, inverse = np.unique(depths, return_inverse=True)
+    fluid_cols = Mobility.Fluid(fluid, values, tsurf, eos, water, setting)
+    fluid_cols = {key: v[inverse.reshape(-1)] for key, v in fluid_cols.items()}
+    prof = Mobility.Velocity(rock_cols, fluid_cols, uncertainty)
+
+    return {"phase": prof["phase"], "T": prof["T"], "P": prof["P"],
+            "density": prof["rho"], "buoyancy": prof["buoyancy"],
+            "viscosity": prof["mu"], "mobility": prof["mob_v"], 
+            "mobility_uc": prof.get("mob_v_uc", np.nan), "vmax": prof["vmax"]}
+
+def _cached(rock_ids, depths, fluid, eos, tsurf, setting, uncertainty, water):
+
+    # _columns through the result cache, per rock: rocks found in the cache 
+    # are read back and only the others are calculated
+    store = _results["store"]
+    name, Vc = data.Fluid.Name(fluid)
+    data.Data.Stamp()                       # re-read tables changed on disk
+    perm, comp = data.Data.Arrays()
+    common = (("sweep", results.Output.Code(), tuple(name.MWs), tuple(name.Tcs),
+               tuple(name.Pcs), tuple(name.omegas), tuple(Vc), eos, float(tsurf), 
+               data.Data.Setting(setting).params(), bool(uncertainty)) + 
+              viscosity.Viscosity.Mode(name, eos) + viscosity.Water.Mode(water, eos))
+
+    cols = {col: np.empty(len(depths), dtype="<U3" if col == "phase" else float)
+            for col in COLUMNS}
+    missing = np.zeros(len(depths), dtype=bool)
+    keys = {}
+    for row in np.unique(rock_ids):
+        rows = rock_ids == row
+        keys[row] = cache.Store.key(*common, data.ROCKS[row], perm[row], comp[row], 
+                                    depths[rows])
+        value = store.get(keys[row])
+        if value is None:
+            missing |= rows
+            continue
+        n = int(rows.sum())
+        cols["phase"][rows] = PHASES[np.frombuffer(value, np.uint8, n)]
+        block = np.frombuffer(value, float, offset=n).reshape(len(COLUMNS) - 1, n)
+        for col, values in zip(COLUMNS[1:], block):
+            cols[col][rows] = values
+
+    if missing.any():
+        new = _columns(None, rock_ids[missing], depths[missing], fluid, eos, tsurf, 
+                       setting, uncertainty, water)
+        for col in COLUMNS:
+            cols[col][missing] = new[col]
+        for row in np.unique(rock_ids[missing]):
+            rows = rock_ids == row
+            phase = np.zeros(int(rows.sum()), dtype=np.uint8)
+            for i, label in enumerate(PHASES):
+                phase[cols["phase"][rows] == label] = i
+            block = np.array([cols[col][rows] for col in COLUMNS[1:]])
+            store.put(keys[row], phase.tobytes() + block.tobytes())
+
+    if not uncertainty:
+        cols["mobility_uc"] = np.nan
+
+    return cols
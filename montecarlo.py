@@ -0,0 +1,81 @@
+# Monte Carlo uncertainty of maximum vertical velocity (vmax)
+# Bhavik Harish Lodhia
+
+import numpy as np
+import data
+import permeability
+import mobility
+
+# Default half-widths of the uniform distributions sampled for each parameter:
+# relative for the Athy parameters and porosity anchors, in log[mD] for the
+# permeability anchors and in units of the Holmes (2009) uncertainties for Q
+# and C (1 for the full value +/- uncertainty range, see permeability.HOLMES)
+SPREAD = {"dpor": 0.1, "athyk": 0.1, "phi": 0.1, "k": 0.5, "Q": 1., "C": 1.}
+
+###############################################################################
+
+class MonteCarlo:
+
+    def Samples(n, seed=None):
+
+        # Draw n parameter samples as standard uniform deviates in [-1, 1], one
+        # array per parameter. The same samples apply to every depth of a profile
+        rng = np.random.default_rng(seed)
+        names = ["Q", "C", "dpor", "athyk", "phi0", "phi1", "phi2", "k0", "k1", "k2"]
+        u = rng.uniform(-1.0, 1.0, size=(len(names), n))
+
+        return dict(zip(names, u))
+
+    def vmax(Fluid, rock, depth, tsurf, EOS, n=10000, seed=None, spread=None,
+             percentiles=(10, 50, 90), batch=500000, setting=3):
+
+        # Monte Carlo vmax (m/year) along a depth profile. Q, C, the Athy
+        # parameters and the multipoint porosity/permeability anchors are
+        # sampled from uniform distributions (see SPREAD); the fluid properties
+        # are solved once per depth and shared by all samples. Depths are
+        # evaluated in chunks of about batch values so memory stays bounded.
+        # setting is the geological setting, see data.Data.Setting.
+        # Returns a dict with depth, the nominal vmax, the sample mean and the
+        # requested percentiles, e.g. "P10", "P50", "P90"
+        half = dict(SPREAD)
+        half.update(spread or {})
+        u = MonteCarlo.Samples(n, seed)
+        mD = 9.869233e-15                       # conversion from mD to m^2
+
+        depth = np.asarray(depth, dtype=float)
+        rows = np.broadcast_to(data.Data.Ids(rock), depth.shape)
+        permeability.Profile.Holmes(rows)       # raises without constants
+
+        fluid = mobility.Mobility.Fluid(Fluid, depth, tsurf, EOS, setting=setting)
+        nominal = mobility.Mobility.Velocity(
+            permeability.Profile.Rock(rows, depth, False), fluid, False)["vmax"]
+
+        # perturbations of the lithology parameters, samples along axis 1 of
+        # the depths (see permeability.Profile.Perturbed)
+        perturb = {"dpor": 1 + half["dpor"]*u["dpor"], 
+                   "athyk": 1 + half["athyk"]*u["athyk"],
+                   "phi": [1 + half["phi"]*u[p] for p in ("phi0", "phi1", "phi2")],
+                   "dk": [half["k"]*u[k] for k in ("k0", "k1", "k2")],
+                   "Q": half["Q"]*u["Q"], "C": half["C"]*u["C"]}
+
+        result = {"depth": depth, "vmax": nominal,
+                  "mean": np.empty(len(depth))}
+        for q in percentiles:
+            result["P%g" % q] = np.empty(len(depth))
+
+        step = max(1, batch // max(n, 1))
+        for s in range(0, len(depth), step):
+            kv, kro = permeability.Profile.Perturbed(rows[s:s + step, None],
+                                                     depth[s:s + step, None],
+                                                     **perturb)
+
+            scale = (mD*fluid["buoyancy"][s:s + step]/fluid["mu"][s:s + step]*
+                     3.154e7)[:, None]
+            v = 10**kv*kro*scale
+
+            result["mean"][s:s + step] = v.mean(axis=1)
+            pct = np.percentile(v, percentiles, axis=1)
+            for q, values in zip(percentiles, pct):
+                result["P%g" % q][s:s + step] = values
+
+        return result
@@ -0,0 +1,242 @@
+# Write Mobility results to partitioned columnar files
+# Bhavik Harish Lodhia
+
+import os
+import json
+import hashlib
+import datetime
+import numpy as np
+import pandas as pd
+import data
+
+# Parquet output needs pyarrow (pip install pyarrow), without it results are
+# written as numpy .npz files
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CITATION_CFF = os.path.join(HERE, "CITATION.cff")
+
+# Modules that calculate results and the sha256 of their source, see 
+# Output.Code
+SOURCES = ("data.py", "permeability.py", "viscosity.py", "mobility.py")
+_code = {}
+
+FORMATS = ("parquet", "npz", "csv")
+
+# Dataset description written next to the data files, see Writer.close
+METADATA = "metadata.json"
+
+###############################################################################
+
+class Output:
+
+    def Version():
+
+        # Software version from CITATION.cff
+        try:
+            with open(CITATION_CFF) as f:
+                for line in f:
+                    if line.startswith("version:"):
+                        return line.split(":", 1)[1].strip().strip('"\'')
+        except OSError:
+            pass
+
+        return "unknown"
+
+    def Code():
+
+        # sha256 of the source of the modules that calculate results, so 
+        # stored results are not reused once the code changes
+        if "sha256" not in _code:
+            digest = hashlib.sha256()
+            for name in SOURCES:
+                with open(os.path.join(HERE, name), "rb") as f:
+                    digest.update(f.read())
+            _code["sha256"] = digest.hexdigest()
+
+        return _code["sha256"]
+
+    def Inputs():
+
+        # sha256 of the lithology tables the results were calculated from
+        hashes = {}
+        for path in (data.PERMEABILITY_CSV, data.COMPACTION_CSV):
+            with open(path, "rb") as f:
+                hashes[os.path.basename(path)] = hashlib.sha256(f.read()).hexdigest()
+
+        return hashes
+
+    def Format(format=None):
+
+        # Parquet if pyarrow is installed, else npz
+        if format is None:
+            return "parquet" if pq is not None else "npz"
+        if format not in FORMATS:
+            raise ValueError("Unknown output format %r, choose from %s"
+                             % (format, ", ".join(FORMATS)))
+        if format == "parquet" and pq is None:
+            raise ValueError("Parquet output needs pyarrow, install it or use "
+                             "format='npz' or 'csv'")
+        return format
+
+    def Read(path):
+
+        # Read a dataset written by Writer back into one DataFrame, parts in
+        # the order they were written
+        if not os.path.exists(os.path.join(path, METADATA)):
+            raise ValueError("%s holds no complete results (no %s), the run "
+                             "writing it may have failed" % (path, METADATA))
+        with open(os.path.join(path, METADATA)) as f:
+            meta = json.load(f)
+
+        frames = []
+        for part in meta["files"]:
+            file = os.path.join(path, part)
+            if meta["format"] == "parquet":
+                frames.append(pq.read_table(file).to_pandas())
+            elif meta["format"] == "npz":
+                with np.load(file) as f:
+                    frames.append(pd.DataFrame({col: f[col] for col in meta["columns"]}))
+            else:
+                frames.append(pd.read_csv(file))
+
+        if not frames:
+            return pd.DataFrame(columns=meta["columns"])
+        return pd.concat(frames, ignore_index=True)
+
+###############################################################################
+
+class Writer:
+
+    # Appends chunks of results (DataFrames or dicts of equal length columns)
+    # to a directory of columnar files, one sub-directory per value of the
+    # partition columns (e.g. fluid=H2/eos=PR78/). Parquet files get one row
+    # group per chunk, npz output one part file per chunk and csv one file per
+    # partition, so only the current chunk is held in memory. metadata.json
+    # records the software version, the sha256 of the source of the 
+    # calculating modules (see Output.Code) and of the lithology tables, the
+    # columns, row count, files and any metadata passed in. It is written
+    # last, and not at all when the with block raises, so a directory without
+    # it holds no complete results.
+    #
+    #   with Writer("results", partition_by=["fluid", "eos"]) as out:
+    #       for frame in frames:
+    #           out.write(frame)
+    #   df = Output.Read("results")
+
+    def __init__(self, path, format=None, partition_by=(), metadata=None,
+                 overwrite=False):
+
+        self.path = path
+        self.format = Output.Format(format)
+        self.partition_by = list(partition_by or ())
+        self.metadata = dict(metadata or {})
+        self.columns = None
+        self.rows = 0
+        self.files = []
+        self.parts = {}                 # open parquet writers or part counters
+        self.meta = None                # set by close
+
+        if os.path.exists(os.path.join(path, METADATA)):
+            if not overwrite:
+                raise ValueError("%s already holds results, choose another path "
+                                 "or pass overwrite=True" % path)
+            # the old results are invalid once their files are overwritten
+            os.remove(os.path.join(path, METADATA))
+        os.makedirs(path, exist_ok=True)
+        self.created = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    def write(self, chunk):
+
+        # Append one chunk of rows
+        frame = chunk if isinstance(chunk, pd.DataFrame) else pd.DataFrame(chunk)
+        if self.columns is None:
+            self.columns = list(frame.columns)
+            missing = [col for col in self.partition_by if col not in self.columns]
+            if missing:
+                raise ValueError("Partition columns %s are not in the results"
+                                 % ", ".join(missing))
+        elif list(frame.columns) != self.columns:
+            raise ValueError("All chunks must have the columns %s" % self.columns)
+        if not len(frame):
+            return
+
+        if self.partition_by:
+            groups = frame.groupby(self.partition_by, sort=False)
+        else:
+            groups = [((), frame)]
+        for values, part in groups:
+            if not isinstance(values, tuple):
+                values = (values,)
+            self.append(os.path.join(*(["."] + ["%s=%s" % kv for kv in
+                                                 zip(self.partition_by, values)])),
+                        part)
+        self.rows += len(frame)
+
+    def append(self, folder, frame):
+
+        # Append rows to the files of one partition
+        os.makedirs(os.path.join(self.path, folder), exist_ok=True)
+        if self.format == "parquet":
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            writer = self.parts.get(folder)
+            if writer is None:
+                name = os.path.normpath(os.path.join(folder, "part-00000.parquet"))
+                writer = pq.ParquetWriter(os.path.join(self.path, name), table.schema)
+                self.parts[folder] = writer
+                self.files.append(name)
+            writer.write_table(table)
+
+        elif self.format == "npz":
+            n = self.parts.get(folder, 0)
+            self.parts[folder] = n + 1
+            name = os.path.normpath(os.path.join(folder, "part-%05d.npz" % n))
+            # strings as fixed width unicode so no pickling is needed to read
+            np.savez(os.path.join(self.path, name),
+                     **{col: (frame[col].to_numpy() 
+                              if pd.api.types.is_numeric_dtype(frame[col])
+                              else frame[col].to_numpy().astype(str)) 
+                        for col in self.columns})
+            self.files.append(name)
+
+        else:
+            name = os.path.normpath(os.path.join(folder, "part-00000.csv"))
+            header = folder not in self.parts
+            self.parts[folder] = True
+            frame.to_csv(os.path.join(self.path, name), mode="w" if header else "a",
+                         header=header, index=False)
+            if header:
+                self.files.append(name)
+
+    def close(self, complete=True):
+
+        # Finish the files and write metadata.json. complete=False (not all
+        # results were written) only closes the files
+        if self.format == "parquet":
+            for writer in self.parts.values():
+                writer.close()
+        self.parts = {}
+        if not complete:
+            return None
+
+        meta = {"software": "hydrogen_mobility", "version": Output.Version(),
+                "code": Output.Code(), "inputs": Output.Inputs(), 
+                "created": self.created,
+                "format": self.format, "columns": self.columns or [],
+                "partition_by": self.partition_by, "rows": self.rows,
+                "files": self.files, "metadata": self.metadata}
+        with open(os.path.join(self.path, METADATA), "w") as f:
+            json.dump(meta, f, indent=1, default=str)
+        self.meta = meta
+
+        return meta
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(exc[0] is None)
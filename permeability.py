@@ -2,8 +2,29 @@
 # Bhavik Harish Lodhia
 
 import math
+import hashlib
+import numpy as np
 from uncertainties import ufloat
 import data as data    
+import cache
+
+# Kozeny-Carman constants per rock family: specific surface S0, multiplier 
+# and porosity exponent for porosities <= 0.1
+KC = {"Sandstone": (10**6, 10, 1),
+      "Siltstone": (10**7, 0.5, 5),
+      "Shale": (10**8, 0.01, 5)}
+
+# Holmes (2009) C (value, uncertainty) per lithology class and Q for all
+HOLMES = {"clastic": (0.06, 0.04),       # 0.02 < C < 0.1
+          "carbonate": (0.035, 0.025)}   # C = ufloat(0.0325,0.0275)
+HOLMES_Q = (1.05, 0.25)                  # 0.8 < Q < 1.3
+
+# Profile.Rock results keyed on rock ids, depths and the lithology tables
+# (at most 256 profiles and 256 MB of arrays), the optional on-disk layer
+# (see Profile.CacheConfig) and the largest number of points a cached profile
+# may have
+_rock_cache = cache.LRU(maxsize=256, maxbytes=2**28)
+_rock_config = {"disk": None, "max_points": 10**6}
  
 ###############################################################################   
 
@@ -11,17 +32,16 @@ class Permeability:
     
     def k(method, rock, porosity):   
         
-        df, athy, compaction = data.Data.Params()    
-        row = data.Data.Name(rock)    
-    
-        # Assign variables from dataframe depending on lithology
-        ak = df.values[row,1]
-        phi0 = df.values[row,2]
-        phi1 = df.values[row,3]
-        phi2 = df.values[row,4]
-        k0 = df.values[row,5]
-        k1 = df.values[row,6]
-        k2 = df.values[row,7]
+        lith = data.Data.Rock(rock)    
+    
+        # Assign variables from lithology table depending on lithology
+        ak = lith.ak
+        phi0 = lith.phi0
+        phi1 = lith.phi1
+        phi2 = lith.phi2
+        k0 = lith.k0
+        k1 = lith.k1
+        k2 = lith.k2
     
         # Calculate permeability from linear multipoint function
         if method == "multipoint" and porosity < phi1:
@@ -34,36 +54,19 @@ class Permeability:
         elif method == "multipoint" and porosity > phi2:
             x = k2
     
-        elif rock == "Sandstone" or rock == "Sandstone-clayrich" or  \
-            rock == "Sandstone-claypoor" and method == "KC":
-        
-            S0 =  10**6
+        elif method == "KC":
+
+            # Kozeny-Carman constants for the rock family
+            family = data.Data.Family(rock)
+            if family not in KC:
+                raise ValueError("KC permeability is only available for %s, not %r" 
+                                 % (", ".join(KC), rock))
+            S0, f, n = KC[family]
             phi = porosity - (3.1*10**-10)*S0
             if phi <= 0.1:
-                y = (2*10**16)*10*(phi/(S0**2 * (1-phi)**2))
-            elif phi > 0.1:
-                y = (2*10**14)*10*(phi**3/(S0**2 * (1-phi)**2))  
-        
-        elif rock == "Siltstone" or rock == "Siltstone-orgrich" or  \
-            rock == "Siltstone-TOC10" or rock == "Siltstone-TOC2-3" and method == "KC":
-            
-            S0 = 10**7
-            phi = porosity - (3.1*10**-10)*S0 
-            if phi <= 0.1:            
-                y = (2*10**16)*0.5*(phi**5/(S0**2 * (1-phi)**2))
+                y = (2*10**16)*f*(phi**n/(S0**2 * (1-phi)**2))
             elif phi > 0.1:
-                y = (2*10**14)*0.5*(phi**3/(S0**2 * (1-phi)**2))                
- 
-        elif rock == "Shale" or rock == "Shale-sandy" or rock == "Shale-silicious"  \
-            or rock == "Shale-silty" or rock == "Shale-opalCT" or rock == "Shale-black" \
-            or rock == "Shale-orgrich" or rock == "Shale-TOC3" or rock == "Shale-TOC8" \
-            or rock == "Shale-TOC20" and method == "KC":
-            S0 = 10**8
-            phi = porosity - (3.1*10**-10)*S0 
-            if phi <= 0.1:            
-                y = (2*10**16)*0.01*(phi**5/(S0**2 * (1-phi)**2))
-            elif phi > 0.1:
-                y = (2*10**14)*0.01*(phi**3/(S0**2 * (1-phi)**2))
+                y = (2*10**14)*f*(phi**3/(S0**2 * (1-phi)**2))  
 
 
         if method == "multipoint":
@@ -93,16 +96,11 @@ class Permeability:
         # Relative permeability calculation using quadratic formula from Hantschel
         # (2009), Ringrose and Corbett (1994) methods
     
-        if rock == "Sandstone" or "Siltstone" or "Conglomerate" or "Limestone" \
-            or "Marl" or "Dolomite":
-            Swc = 5/100
-            Sgc = 0.00
-            Soc = 0.10/100
-            
-        elif rock == "Shale":
-            Swc = 5/100
-            Sgc = 0.00
-            Soc = 1.00/100     
+        # The same end-point saturations are used for all lithologies
+        Swc = 5/100
+        Sgc = 0.00
+        Soc = 0.10/100
+        # Soc = 1.00/100 for shales
             
         if equation == "Quadratic" and regime == "WL":        # water-liquid phase
             Swe = (S-Swc)/(1 - Swc - Soc)           # normalised water saturation
@@ -133,13 +131,11 @@ class Permeability:
     
     def Porosity(rock, depth):
         # Athy (1930) formula with depth in METRES and porosity given from 0 to 1
-        athy = data.Data.Params()[1]
+        lith = data.Data.Rock(rock)
     
-        row = data.Data.Name(rock)
-    
-        # Assign variables from dataframe depending on lithology        
-        dpor = athy.values[row,1]  # depositional porosity
-        athyk = athy.values[row,2] # Athy compaction wavelength in km, *1000 to use metres
+        # Assign variables from lithology table depending on lithology        
+        dpor = lith.dpor    # depositional porosity
+        athyk = lith.athyk  # Athy compaction wavelength in km, *1000 to use metres
     
         porosity = (dpor*math.exp(-depth/athyk))/100
         return porosity
@@ -155,7 +151,7 @@ class Permeability:
     
         # porosity**(Q) * Swi = constant
     
-        Q = ufloat(1.05, 0.25) # 0.8 < Q < 1.3 for sandstones and cbates (Holmes 2009)
+        Q = ufloat(*HOLMES_Q)  # 0.8 < Q < 1.3 for sandstones and cbates (Holmes 2009)
 
     
         if rock == "Sandstone":  
@@ -190,52 +186,278 @@ class Permeability:
         # For carbonates, 0.005 < C < 0.06  - approximated for all carbonates
         # For all rock types, 0.8 < Q < 1.3
     
-        row = data.Data.Name(rock)
-        athy = data.Data.Params()[1]
+        lith = data.Data.Rock(rock)
     
-        # Assign variables from dataframe depending on lithology
-        dpor = athy.values[row,1]  # depositional porosity
-        athyk = athy.values[row,2] # Athy compaction wavelength, *1000 for metres
+        # Assign variables from lithology table depending on lithology
+        dpor = lith.dpor    # depositional porosity
+        athyk = lith.athyk  # Athy compaction wavelength, *1000 for metres
     
         porosity = (dpor*math.exp(-depth/athyk))/100
         # return porosity
 
-        Q = ufloat(1.05, 0.25) # 0.8 < Q < 1.3 for sandstones and cbates (Holmes 2009)
+        Q = ufloat(*HOLMES_Q)  # 0.8 < Q < 1.3 for sandstones and cbates (Holmes 2009)
     
         # Holmes (2009) parameters
     
         
-        # for SANDSTONES  (I'm using this for all clastics here!)
-        if rock == "Sandstone" or rock == "Sandstone-clayrich" \
-        or rock == "Sandstone-claypoor" or rock == "Quartzite" \
-        or rock == "Quartzite-quartz" or rock == "Subarkose" \
-        or rock == "Subarkose-quartz" or rock == "Subarkose-clayrich" \
-        or rock == "Subarkose-claypoor" or rock == "Subarkose-dolomite" \
-        or rock == "Arkose" or rock == "Arkose-quartzrich" \
-        or rock == "Arkose-quartzpoor" or rock == "Arkose-clayrich" \
-        or rock == "Arkose-claypoor" or rock == "Arkose-dolomite" \
-        or rock == "Siltstone" or rock == "Siltstone-orgrich" \
-        or rock == "Siltstone-TOC10" or rock == "Siltstone-TOC2-3" \
-        or rock == "Conglomerate" or rock == "Conglomerate-quartzite":
-
-            C = ufloat(0.06, 0.04)
-    
-    
-        # for CARBONATES
-        elif rock == "Limestone-OG" or rock ==  "Limestone-WM" or rock ==  "Micrite" \
-        or rock == "Limestone-shaley" or rock == "Limestone-orgrich" \
-        or rock == "Limestone-TOC1-2" or rock == "Limestone-TOC10" \
-        or rock == "Marl" or rock == "Dolomite" or rock == "Dolomite-sandy" \
-        or rock == "Dolomite-silty" or rock == "Dolomite-org":
-        
-            # C = ufloat(0.0325,0.0275)
-            C = ufloat(0.035,0.025)
+        # Holmes (2009) C for the lithology class (sandstone values are used for 
+        # all clastics and carbonate values for all carbonates)
+        cls = data.Data.Class(rock)
+        if cls not in HOLMES:
+            raise ValueError("Holmes (2009) constants are only available for "
+                             "clastics and carbonates, not %r" % (rock,))
+        C = ufloat(*HOLMES[cls])
 
         # Holmes (2009) equation
         Sw = C/(porosity**Q)
-        if Sw > 1:
+        if Sw.n > 1:
             Sw = ufloat(1,1)         # set Swi = 1.0 +/-1 for low porosities
         return depth, porosity, Sw
 #        elif porosity > dpor:
 #            pass          
-###############################################################################       
\ No newline at end of file
+###############################################################################
+
+class Profile:
+
+    # Array versions of the Permeability functions for whole depth profiles.
+    # rock is a rock name/id or an array of ids (one per depth), uncertainties
+    # are propagated to first order as in the uncertainties package and
+    # returned as separate arrays. The lithology parameters can be perturbed
+    # by arrays that broadcast against the depths (see Profile.Perturbed)
+
+    def Porosity(rock, depth, dpor=1., athyk=1.):
+        # Athy (1930) porosity from 0 to 1 for an array of depths in km, dpor
+        # and athyk scale the depositional porosity and compaction wavelength
+        perm, comp = data.Data.Arrays()
+        rows = data.Data.Ids(rock)
+        dpor = comp[rows, 0]*dpor
+        athyk = comp[rows, 1]*athyk
+    
+        return (dpor*np.exp(-np.asarray(depth, dtype=float)/athyk))/100
+
+###############################################################################   
+
+    def k(rock, porosity, phi=(1., 1., 1.), dk=(0., 0., 0.)):   
+
+        # Multipoint permeability, returns vertical and horizontal permeability 
+        # in log[mD] (see Permeability.k). phi scales the three porosity 
+        # anchors and dk shifts the three permeability anchors (log[mD])
+        perm, comp = data.Data.Arrays()
+        rows = data.Data.Ids(rock)
+        ak, phi0, phi1, phi2, k0, k1, k2 = np.moveaxis(perm[rows], -1, 0)
+        phi0, phi1, phi2 = phi0*phi[0], phi1*phi[1], phi2*phi[2]
+        k0, k1, k2 = k0 + dk[0], k1 + dk[1], k2 + dk[2]
+        
+        x = np.where(porosity < phi1, 
+                     abs(k1 - k0)/(phi1 - phi0)*porosity + k0,
+                     np.where(porosity <= phi2, 
+                              (k2 - k1)/(phi2 - phi1)*porosity + \
+                              (k2 - (k2 - k1)*(phi2 - phi0)/(phi2 - phi1)), 
+                              k2))
+
+        khv = 10**x
+        kv = np.log(khv*1)/np.log(10)
+        kh = np.log(ak*khv*50)/np.log(10)
+        
+        return kv, kh
+
+###############################################################################   
+
+    def SwiZ(rock, depth, uncertainty=True):
+
+        # Holmes (2009) connate water saturation with Athy (1930) porosity, 
+        # returns porosity, Swi and the Swi uncertainty (see Permeability.SwiZ).
+        # With uncertainty=False only nominal values are computed and the 
+        # uncertainty is None
+        rows = data.Data.Ids(rock)
+        C, C_uc = Profile.Holmes(rows)
+        Q, Q_uc = HOLMES_Q
+    
+        porosity = Profile.Porosity(rows, depth)
+        Sw = Profile.Swi(porosity, C, Q)
+        if not uncertainty:
+            return porosity, Sw, None
+
+        # first order uncertainty from C and Q, 1 for low porosities
+        phiQ = porosity**Q
+        Sw_uc = np.sqrt((C_uc/phiQ)**2 + (C*np.log(porosity)/phiQ*Q_uc)**2)
+        Sw_uc = np.where(C/phiQ > 1, 1.0, Sw_uc)
+        
+        return porosity, Sw, Sw_uc
+
+    def Holmes(rock, check=True):
+
+        # Holmes (2009) C and its uncertainty for a rock name/id or an array
+        # of ids, NaN for lithologies without constants (shales, coals and
+        # volcanics), which raise with check=True
+        cls = data.Data.Classes()[data.Data.Ids(rock)]
+        Cn, Cs = np.array([HOLMES.get(c, (np.nan, np.nan)) for c in data.CLASSES]).T
+        if check and np.isnan(Cn[cls]).any():
+            raise ValueError("Holmes (2009) constants are only available for "
+                             "clastics and carbonates")
+
+        return Cn[cls], Cs[cls]
+
+    def Swi(porosity, C, Q=HOLMES_Q[0]):
+        # Holmes (2009) connate water saturation, 1.0 for low porosities
+        Sw = C/porosity**Q
+        return np.where(Sw > 1, 1.0, Sw)
+
+###############################################################################   
+
+    def krp(equation, regime, S, S_uc):
+
+        # Relative permeabilities and their uncertainties for an array of 
+        # saturations (see Permeability.krp). Uncertainties are None if S_uc is
+        Swc = 5/100
+        Sgc = 0.00
+        Soc = 0.10/100
+
+        if equation == "Quadratic" and regime == "WL":
+            Swe = (S-Swc)/(1 - Swc - Soc)
+            krw = 0.4*(Swe)**2
+            krow = 1 - 1.8*(Swe) + 0.8*(Swe)**2
+            if S_uc is None:
+                return krw, None, krow, None
+            krw_uc = abs(0.8*Swe/(1 - Swc - Soc))*S_uc
+            krow_uc = abs((-1.8 + 1.6*Swe)/(1 - Swc - Soc))*S_uc
+            return krw, krw_uc, krow, krow_uc
+
+        elif equation == "Quadratic" and regime == "VL":
+            Sge = (S-Sgc)/(1 - Swc - Sgc)
+            Sgoe = S/(1 - Swc)
+            krg = 0.4*(Sge)**2
+            krog = 1 - 1.8*(Sgoe) + 0.8*(Sgoe)**2
+            if S_uc is None:
+                return krg, None, krog, None
+            krg_uc = abs(0.8*Sge/(1 - Swc - Sgc))*S_uc
+            krog_uc = abs((-1.8 + 1.6*Sgoe)/(1 - Swc))*S_uc
+            return krg, krg_uc, krog, krog_uc
+
+        elif equation == "Ringrose" and regime == "WL":
+            Swe = (S-Swc)/(1 - Swc - Soc)
+            krw = 0.3*Swe**3
+            krow = 0.85*(1 - Swe)**3
+            if S_uc is None:
+                return krw, None, krow, None
+            krw_uc = abs(0.9*Swe**2/(1 - Swc - Soc))*S_uc
+            krow_uc = abs(2.55*(1 - Swe)**2/(1 - Swc - Soc))*S_uc
+            return krw, krw_uc, krow, krow_uc
+        
+        raise ValueError("Unsupported relative permeability method %r for %r" 
+                         % (equation, regime))
+
+###############################################################################   
+
+    def Rock(rock, depth, uncertainty=True):
+
+        # Rock state along a depth profile as used by Mobility.Mobility: 
+        # porosity, permeability, Swi and oil relative permeability with 
+        # uncertainties, as a dict of arrays. With uncertainty=False the 
+        # uncertainty (_uc) columns are left out.
+        # The rock state does not depend on the fluid, EOS or setting, so
+        # profiles are cached (see Profile.CacheConfig) and the arrays are
+        # shared between callers and read only
+        rows = data.Data.Ids(rock)
+        depth = np.asarray(depth, dtype=float)
+        if depth.size > _rock_config["max_points"]:
+            return Profile.State(rows, depth, uncertainty)
+
+        key = Profile.Key(rows, depth, uncertainty)
+        cols = _rock_cache.get(key)
+        if cols is None:
+            disk = _rock_config["disk"]
+            cols = disk.get(key) if disk is not None else None
+            if cols is None:
+                cols = Profile.State(rows, depth.copy(), uncertainty)
+                if disk is not None:
+                    disk.put(key, cols)
+            for values in cols.values():
+                if isinstance(values, np.ndarray):
+                    values.flags.writeable = False
+            _rock_cache.put(key, cols, Profile.Bytes(cols))
+
+        return dict(cols)
+
+    def Key(rows, depth, uncertainty):
+
+        # Digest of the rock ids, depths and lithology tables of a profile
+        digest = hashlib.blake2b(digest_size=16)
+        for values in (rows, depth):
+            digest.update(str(values.shape).encode())
+            digest.update(np.ascontiguousarray(values, dtype=values.dtype).tobytes())
+        digest.update(("%s %s" % (bool(uncertainty), data.Data.Stamp())).encode())
+
+        return digest.hexdigest()
+
+    def Bytes(cols):
+
+        # Memory held by the arrays of a profile, a broadcast rock column
+        # (one rock for all depths) as one value
+        return sum(values.itemsize if 0 in values.strides else values.nbytes
+                   for values in cols.values() if isinstance(values, np.ndarray))
+
+    def CacheConfig(maxsize=256, path=None, max_points=10**6, maxbytes=2**28):
+
+        # Number of profiles and bytes of arrays kept in memory (None for
+        # unbounded), directory of the on-disk layer (None for memory only)
+        # and the largest profile (number of points) that is cached
+        _rock_cache.resize(maxsize, maxbytes)
+        _rock_config["disk"] = cache.Disk(path, "rock") if path is not None else None
+        _rock_config["max_points"] = max_points
+
+    def CacheInfo():
+
+        # hits, misses, size, maxsize, nbytes and maxbytes of the memory cache
+        # and the statistics of the on-disk layer if there is one
+        info = _rock_cache.info()
+        if _rock_config["disk"] is not None:
+            info["disk"] = _rock_config["disk"].info()
+
+        return info
+
+    def CacheClear(disk=False):
+
+        # Empty the memory cache, and with disk=True the on-disk layer
+        _rock_cache.clear()
+        if disk and _rock_config["disk"] is not None:
+            _rock_config["disk"].clear()
+
+    def Perturbed(rock, depth, dpor=1., athyk=1., phi=(1., 1., 1.), dk=(0., 0., 0.),
+                  Q=0., C=0.):
+
+        # Vertical permeability (log[mD]) and oil relative permeability of 
+        # Profile.State with perturbed lithology parameters, e.g. Monte Carlo
+        # samples along a second axis: dpor and athyk as in Profile.Porosity,
+        # phi and dk as in Profile.k, and Q and C in units of their Holmes 
+        # (2009) uncertainties (-1 to 1 for the full range)
+        rows = data.Data.Ids(rock)
+        porosity = Profile.Porosity(rows, depth, dpor, athyk)
+        kv, kh = Profile.k(rows, porosity, phi, dk)
+        Cn, Cs = Profile.Holmes(rows)
+        Sw = Profile.Swi(porosity, Cn + Cs*C, HOLMES_Q[0] + HOLMES_Q[1]*Q)
+        krow = Profile.krp("Quadratic", "WL", Sw, None)[2]
+        krog = Profile.krp("Quadratic", "VL", Sw, None)[2]
+
+        # Aziz and Settari (1979) approximation - phases do not interact
+        return kv, krow*krog
+
+    def State(rows, depth, uncertainty=True):
+
+        # Profile.Rock without the cache
+        porosity, Sw, Sw_uc = Profile.SwiZ(rows, depth, uncertainty)
+        kv, kh = Profile.k(rows, porosity)
+        krw, krw_uc, krow, krow_uc = Profile.krp("Quadratic", "WL", Sw, Sw_uc)
+        krg, krg_uc, krog, krog_uc = Profile.krp("Quadratic", "VL", Sw, Sw_uc)
+        
+        # Aziz and Settari (1979) approximation - phases do not interact
+        kro = krow*krog
+
+        cols = {"depth": depth, "rock": np.broadcast_to(rows, depth.shape), 
+                "porosity": porosity, "kv": kv, "kh": kh, "Sw": Sw, 
+                "krow": krow, "krog": krog, "kro": kro}
+        if uncertainty:
+            cols.update({"Sw_uc": Sw_uc, "krow_uc": krow_uc, "krog_uc": krog_uc,
+                         "kro_uc": np.sqrt((krog*krow_uc)**2 + (krow*krog_uc)**2)})
+
+        return cols
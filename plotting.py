@@ -0,0 +1,140 @@
+# Depth profile plots of Mobility results without a display
+# Bhavik Harish Lodhia
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+
+# Plotted variables: column of the results (Run.sweep / Run.stream names),
+# x axis label, title and the margin added to the largest value for the x range
+PLOTS = {
+    "vmax": ("vmax", "Vertical Velocity [m/year]", "Vertical Velocity vs. Depth", 2),
+    "mobility": ("mobility", "Fluid mobility [m^2/Pas]", "Fluid mobility vs. Depth", 1e-13),
+    "buoyancy": ("buoyancy", "Buoyancy [kg/m^2s^2]", "Buoyancy vs. Depth", 50),
+    "density": ("density", "Fluid density [kg/m^3]", "Fluid density vs. Depth", 5),
+    "viscosity": ("viscosity", "Fluid viscosity [Pas]", "Fluid viscosity vs. Depth", 1e-5),
+    }
+
+###############################################################################
+
+class Plotter:
+
+    # Scatter plots of results against depth, drawn on matplotlib Figure
+    # objects (Agg, no display needed) and saved by a pool of background
+    # threads so plotting does not hold up the calculation. Figures are kept
+    # and reused once their file is written. One panel per variable, one
+    # series per value of the column by (e.g. several rocks in one figure).
+    #
+    #   with Plotter() as plotter:
+    #       for (fluid, eos), frame in results.groupby(["fluid", "eos"]):
+    #           plotter.plot(frame, ["vmax", "mobility"], by="rock",
+    #                        path="%s_%s.png" % (fluid, eos))
+
+    def __init__(self, workers=1, figsize=(8, 6), dpi=100):
+
+        # workers=0 saves in the calling thread
+        self.figsize = figsize
+        self.dpi = dpi
+        self.pool = ThreadPoolExecutor(workers) if workers else None
+        self.pending = []
+        self.free = {}                  # idle figures keyed on the panel count
+        self.lock = threading.Lock()
+
+    def figure(self, n):
+
+        # Idle figure with n panels side by side, or a new one
+        with self.lock:
+            figures = self.free.get(n)
+            if figures:
+                fig = figures.pop()
+                for ax in fig.axes:
+                    ax.cla()
+                return fig
+
+        fig = Figure(figsize=(self.figsize[0]*n, self.figsize[1]), dpi=self.dpi)
+        fig.subplots(1, n, squeeze=False)
+        return fig
+
+    def release(self, fig, n):
+        with self.lock:
+            self.free.setdefault(n, []).append(fig)
+
+    def draw(self, fig, frame, variables, by):
+
+        # Scatter each variable against depth, one series per value of by
+        depth = np.asarray(frame["depth"], dtype=float)
+        if by is not None and by in frame:
+            labels = np.asarray(frame[by])
+            groups = [(label, labels == label) for label in dict.fromkeys(labels)]
+        else:
+            groups = [(None, slice(None))]
+
+        for ax, variable in zip(fig.axes, variables):
+            if variable not in PLOTS:
+                raise ValueError("Unknown plot variable %r, choose from %s"
+                                 % (variable, ", ".join(PLOTS)))
+            column, xlabel, title, margin = PLOTS[variable]
+            x = np.asarray(frame[column], dtype=float)
+            for label, rows in groups:
+                ax.scatter(x[rows], depth[rows], label=label)
+
+            ax.set_ylim(0, np.nanmax(depth) + 0.5)
+            ax.set_xlim(0, np.nanmax(x) + margin)
+            ax.invert_yaxis()
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel('Depth [km]')
+            ax.set_title(title)
+            ax.grid(True)
+            if len(groups) > 1:
+                ax.legend()
+
+        return fig
+
+    def plot(self, frame, variables="vmax", by="rock", path=None):
+
+        # Plot a DataFrame or dict of columns with a "depth" column and write
+        # it to path (format from the extension) in the background. Returns
+        # the Future of the save, or the figure when path is None (the figure
+        # is then not reused)
+        if isinstance(variables, str):
+            variables = [variables]
+        n = len(variables)
+        fig = self.draw(self.figure(n), frame, variables, by)
+        if path is None:
+            return fig
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        if self.pool is None:
+            self.save(fig, n, path)
+            return None
+        future = self.pool.submit(self.save, fig, n, path)
+        self.pending.append(future)
+        return future
+
+    def save(self, fig, n, path):
+        try:
+            fig.savefig(path)
+        finally:
+            self.release(fig, n)
+        return path
+
+    def wait(self):
+
+        # Wait for the files written so far, returns their paths
+        pending, self.pending = self.pending, []
+        return [future.result() for future in pending]
+
+    def close(self):
+        self.wait()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
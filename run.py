@@ -20,14 +20,25 @@ variable = "vmax" # Choose from vmax, mobility, buoyancy, density, viscosity
 setting = 3 # Geological settings: 1 = 1 = cool overpressured, 2.5 MPa/K, 2 = overpressured, 1.0 MPa/K, 3 = typical, 0.5 MPa/k
             # 4 = hydrostatic, 0.3 MPa/K, 5 = hot hydrostatic, 0.1 MPa/K (see Lodhia & Clark 2022 for more information)
             # Default choice for setting is normal geological conditions.
+            # For other geothermal or pressure gradients use e.g. data.Setting(gradient=30, pressure=10)
+            # (degrees/km and MPa/km, see README)
 depths = [0.0,0.1,0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1.0,1.1,1.2,1.3,1.4,1.5,1.6, \
           1.7, 1.8,1.9,2.0] # Values must be a list, i.e. [depth1, depth2, ...]
 tsurf = 20. # Surface temperature. Value must be a float!
 eos = "PR78" # Equation of state. See documentation for further information.
 rock = "Sandstone" # Rock type. See documentation for list of rock types
-fluid = "H2" # Example for Hydrogen
+fluid = "H2" # Example for Hydrogen, or a list to compare fluids in one run, e.g. ["H2", "CH4", "CO2"]
 
-mobility.Run.run(fluid,rock,depths,tsurf,setting,eos,output="on",plot=variable,save="false") # Requires fluid, rock, depths (must be a list), surface temperature,
-                                                                                                # EOS, output ("on" or "off") displayed in terminal, plot ("name of variable")
-                                                                                                # save ("on" will save output as csv file and plot as png file, anything
-                                                                                                # else will not save)
\ No newline at end of file
+mobility.Run.run(fluid,rock,depths,tsurf,setting,eos,output="on",plot=variable,save="false",show=True) # Requires fluid, rock, depths (must be a list), surface temperature,
+                                                                                                       # EOS, output ("on" or "off") displayed in terminal, plot ("name of variable")
+                                                                                                       # save ("on" will save output as csv file and plot as png file, anything
+                                                                                                       # else will not save)
+                                                                                                       # show=True opens a plot window, otherwise plots are only saved
+
+# To compare several rocks, settings, surface temperatures or equations of state
+# in one go use mobility.Run.sweep, which returns a single table, e.g.
+# results = mobility.Run.sweep([fluid], sandstone + arkose, depths, tsurfs=[tsurf], 
+#                              settings=[1, 2, 3, 4, 5], eoss=[eos])
+# or, for large sweeps, stream the results to disk instead of memory
+# mobility.Run.sweep([fluid], sandstone + arkose, depths, settings=[1, 2, 3, 4, 5],
+#                    out="results")          # read back with output.Output.Read
@@ -0,0 +1,146 @@
+# Tests of the SQLite result cache of Run.sweep (cache.Store)
+# Bhavik Harish Lodhia
+
+import os
+import pickle
+import shutil
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+import cache
+import data
+import mobility
+import output
+
+DEPTHS = np.array([0.0, 0.1, 0.5, 1.0, 2.0, 3.5])
+ROCKS = ["Sandstone", "Chalk", "Arkose"]
+
+###############################################################################
+
+@pytest.fixture
+def store(tmp_path):
+
+    # result cache in a fresh database, switched off again after the test
+    mobility.Run.CacheConfig(str(tmp_path / "results.sqlite"))
+    yield tmp_path / "results.sqlite"
+    mobility.Run.CacheConfig(None)
+
+def sweep(**kwargs):
+    warnings.simplefilter("ignore")
+    return mobility.Run.sweep(["H2", "CH4"], ROCKS, DEPTHS, (10., 20.), (1, 3),
+                              **kwargs)
+
+def test_warm_run_matches_cold_run(store):
+
+    # the second run reads every result back from the cache and returns the
+    # frame of the first run and of a run without the cache
+    cold = sweep()
+    info = mobility.Run.CacheInfo()
+    assert info["hits"] == 0 and info["misses"] == info["entries"] == 2*2*2*len(ROCKS)
+
+    warm = sweep()
+    info = mobility.Run.CacheInfo()
+    assert info["hits"] == info["entries"] and info["misses"] == info["entries"]
+    pd.testing.assert_frame_equal(warm, cold)
+
+    mobility.Run.CacheConfig(None)
+    pd.testing.assert_frame_equal(sweep(), cold)
+
+def test_code_change_misses(store, monkeypatch):
+
+    # results stored by other code are not reused
+    sweep()
+    monkeypatch.setitem(output._code, "sha256", "0"*64)
+    before = mobility.Run.CacheInfo()
+    sweep()
+    info = mobility.Run.CacheInfo()
+    assert info["hits"] == before["hits"]
+    assert info["misses"] - before["misses"] == before["entries"]
+
+def test_lithology_change_misses_that_rock(store, tmp_path, monkeypatch):
+
+    # after an edit to one rock in the csv files only that rock is calculated
+    # again, with the new parameters
+    for name in ("PERMEABILITY_CSV", "COMPACTION_CSV"):
+        path = tmp_path / os.path.basename(getattr(data, name))
+        shutil.copyfile(getattr(data, name), path)
+        monkeypatch.setattr(data, name, str(path))
+    try:
+        data.Data.Reload(force=True)
+        cold = sweep()
+
+        path = data.PERMEABILITY_CSV
+        with open(path, "rb") as f:
+            lines = f.read().split(b"\n")
+        row = data.Data.Name("Sandstone")
+        fields = lines[row].split(b",")
+        fields[5] = str(float(fields[5]) + 1.).encode()
+        lines[row] = b",".join(fields)
+        with open(path, "wb") as f:
+            f.write(b"\n".join(lines))
+        mtime = os.path.getmtime(path) + 10.
+        os.utime(path, (mtime, mtime))
+
+        before = mobility.Run.CacheInfo()
+        warm = sweep()
+        info = mobility.Run.CacheInfo()
+        runs = 2*2*2
+        assert info["misses"] - before["misses"] == runs
+        assert info["hits"] - before["hits"] == runs*(len(ROCKS) - 1)
+
+        changed = warm["rock"] == "Sandstone"
+        assert (warm.loc[changed, "vmax"] > cold.loc[changed, "vmax"]).all()
+        pd.testing.assert_frame_equal(warm[~changed], cold[~changed])
+    finally:
+        monkeypatch.undo()
+        data.Data.Reload(force=True)
+
+def test_maxbytes_evicts_least_recently_used(tmp_path):
+
+    # past maxbytes the least recently used values are deleted down to 90% of
+    # it; a value read since it was written is kept
+    store = cache.Store(str(tmp_path / "store.sqlite"), maxbytes=1000)
+    keys = [cache.Store.key("value", i) for i in range(11)]
+    for key in keys[:9]:
+        store.put(key, bytes(100))
+    assert store.get(keys[0]) == bytes(100)
+    store.flush()
+    for key in keys[9:]:
+        store.put(key, bytes(100))
+
+    info = store.info()
+    assert info["bytes"] <= 900 and info["entries"] == 9
+    for key in (keys[0],) + tuple(keys[9:]):
+        assert store.get(key) is not None
+    assert store.get(keys[1]) is None
+    store.close()
+
+def test_store_pickles_without_connection(tmp_path):
+
+    # worker processes get a copy that opens its own connection
+    store = cache.Store(str(tmp_path / "store.sqlite"))
+    store.put(cache.Store.key("value"), b"abc")
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.conn is None
+    assert copy.get(cache.Store.key("value")) == b"abc"
+    copy.close()
+    store.close()
+
+def test_workers_share_one_database(store):
+
+    # two worker processes write their results to the same database file,
+    # from which a serial run reads all of them back (results are stored per
+    # rock and chunk of depths, one chunk per rock here as in the serial run)
+    mobility.Run.CacheConfig(None)
+    serial = sweep()
+    mobility.Run.CacheConfig(str(store))
+
+    pd.testing.assert_frame_equal(sweep(workers=2, chunksize=len(DEPTHS)), serial)
+    info = mobility.Run.CacheInfo()
+    assert info["entries"] == 2*2*2*len(ROCKS)
+    assert info["hits"] == info["misses"] == 0
+
+    pd.testing.assert_frame_equal(sweep(), serial)
+    info = mobility.Run.CacheInfo()
+    assert info["misses"] == 0 and info["hits"] == info["entries"]
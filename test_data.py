@@ -0,0 +1,62 @@
+# Tests of the lithology registry
+# Bhavik Harish Lodhia
+
+import os
+import shutil
+import numpy as np
+import pytest
+import data
+import permeability
+
+###############################################################################
+
+def test_ids_of_mixed_names_and_ids():
+
+    # names and ids in one list are each looked up as they are
+    sandstone = data.Data.Name("Sandstone")
+    np.testing.assert_array_equal(data.Data.Ids(["Sandstone", 3]), [sandstone, 3])
+    np.testing.assert_array_equal(data.Data.Ids([np.int64(3), "Sandstone", 3]),
+                                  [3, sandstone, 3])
+    np.testing.assert_array_equal(data.Data.Ids(np.array([["Sandstone"], ["Chalk"]])),
+                                  [[sandstone], [data.Data.Name("Chalk")]])
+
+def test_ids_reject_unknown_rocks():
+
+    # ids written as strings are not names
+    with pytest.raises(ValueError):
+        data.Data.Ids(["Sandstone", "3"])
+    with pytest.raises(ValueError):
+        data.Data.Ids([0, len(data.ROCKS)])
+
+def test_stamp_follows_edited_tables(tmp_path, monkeypatch):
+
+    # an edit to a csv file after loading changes the stamp and the cached 
+    # rock profiles without an explicit Data.Reload
+    for name in ("PERMEABILITY_CSV", "COMPACTION_CSV"):
+        path = tmp_path / os.path.basename(getattr(data, name))
+        shutil.copyfile(getattr(data, name), path)
+        monkeypatch.setattr(data, name, str(path))
+    try:
+        data.Data.Reload(force=True)
+        depths = np.linspace(0., 3., 5)
+        stamp = data.Data.Stamp()
+        kv = permeability.Profile.Rock("Sandstone", depths)["kv"]
+
+        path = data.PERMEABILITY_CSV
+        with open(path, "rb") as f:
+            lines = f.read().split(b"\n")
+        row = data.Data.Name("Sandstone")
+        fields = lines[row].split(b",")
+        fields[5] = str(float(fields[5]) + 1.).encode()
+        lines[row] = b",".join(fields)
+        with open(path, "wb") as f:
+            f.write(b"\n".join(lines))
+        mtime = os.path.getmtime(path) + 10.
+        os.utime(path, (mtime, mtime))
+
+        assert data.Data.Stamp() != stamp
+        # a larger k0 anchor raises the permeability at every depth
+        assert (permeability.Profile.Rock("Sandstone", depths)["kv"] > kv).all()
+    finally:
+        monkeypatch.undo()
+        data.Data.Reload(force=True)
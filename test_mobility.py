@@ -0,0 +1,78 @@
+# Tests of Mobility.Profile against the scalar Mobility.Mobility and of Run.sweep
+# Bhavik Harish Lodhia
+
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+import mobility
+import viscosity
+
+DEPTHS = np.array([0.0, 0.1, 0.5, 1.0, 2.0, 3.5])
+
+###############################################################################
+
+@pytest.mark.parametrize("rock", ["Sandstone", "Limestone-OG", "Arkose"])
+@pytest.mark.parametrize("setting", [1, 3, 5])
+@pytest.mark.parametrize("eos", ["PR78", "SRK", "TWUPR"])
+def test_profile_matches_mobility(rock, setting, eos):
+
+    # every depth of a profile against one Mobility.Mobility call per depth
+    warnings.simplefilter("ignore")
+    prof = mobility.Mobility.Profile("H2", rock, DEPTHS, 20., eos, setting=setting)
+    for i, depth in enumerate(DEPTHS):
+        point = mobility.Mobility.Mobility("H2", rock, depth, 20., eos, setting)
+        assert prof["phase"][i] == point.phase
+        np.testing.assert_allclose(
+            [prof[key][i] for key in ("T", "P", "mob_v", "mob_v_uc", "mob_h",
+                                      "mob_h_uc", "mu", "rho")],
+            [point.T, point.P, point.mob_v, point.mob_v_uc, point.mob_h,
+             point.mob_h_uc, point.mu, point.rho], rtol=1e-10)
+
+def test_sweep_solves_each_depth_once(monkeypatch):
+
+    # the fluid and water states of a chunk are solved once per depth, not
+    # once per rock and depth
+    warnings.simplefilter("ignore")
+    calls = []
+    batch = viscosity.Cubic.batch
+    def spy(self, T, P):
+        calls.append((self.name.names[0], np.size(T)))
+        return batch(self, T, P)
+    monkeypatch.setattr(viscosity.Cubic, "batch", spy)
+
+    rocks = ["Sandstone", "Limestone-OG", "Arkose", "Chalk"]
+    mobility.Run.sweep("H2", rocks, DEPTHS)
+    solved = {}
+    for name, n in calls:
+        solved[name] = solved.get(name, 0) + n
+    assert set(solved) == {"H2", "H2O"}
+    assert all(n == len(DEPTHS) for n in solved.values())
+
+def test_sweep_workers_match_serial():
+
+    # process pool results are identical to and in the order of the serial run
+    warnings.simplefilter("ignore")
+    args = (["H2", "CH4"], ["Sandstone", "Chalk", "Arkose"], DEPTHS, (10., 20.),
+            (1, 3))
+    serial = mobility.Run.sweep(*args)
+    pd.testing.assert_frame_equal(mobility.Run.sweep(*args, workers=2, chunksize=5),
+                                  serial)
+
+def test_stream_matches_sweep():
+
+    # the frames of Run.stream put together are the Run.sweep results
+    warnings.simplefilter("ignore")
+    args = (["H2", "CH4"], ["Sandstone", "Chalk", "Arkose"], DEPTHS, (10., 20.),
+            (1, 3))
+    serial = mobility.Run.sweep(*args)
+    for workers in (None, 2):
+        frames = list(mobility.Run.stream(*args, chunk=5, workers=workers))
+        assert all(len(frame) <= 5 for frame in frames)
+        stream = pd.concat(frames, ignore_index=True)
+        # frames come per chunk, then per fluid, EOS, surface temperature and
+        # setting, so the rows are in a different order than Run.sweep
+        keys = ["fluid", "eos", "tsurf", "setting", "rock", "depth"]
+        pd.testing.assert_frame_equal(
+            stream.sort_values(keys, kind="stable").reset_index(drop=True),
+            serial.sort_values(keys, kind="stable").reset_index(drop=True))
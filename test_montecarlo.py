@@ -0,0 +1,24 @@
+# Tests of the Monte Carlo vmax engine
+# Bhavik Harish Lodhia
+
+import warnings
+import numpy as np
+import mobility
+import montecarlo
+
+###############################################################################
+
+def test_zero_spread_reproduces_profile():
+
+    # without spread every sample is the nominal rock, so all statistics are
+    # the Mobility.Profile vmax
+    warnings.simplefilter("ignore")
+    depth = np.linspace(0.1, 4., 25)
+    rock = np.resize([19, 12, 2], len(depth))
+    spread = {key: 0. for key in montecarlo.SPREAD}
+    result = montecarlo.MonteCarlo.vmax("H2", rock, depth, 20., "PR78", n=50, seed=1,
+                                        spread=spread)
+    vmax = mobility.Mobility.Profile("H2", rock, depth, 20., "PR78",
+                                     uncertainty=False)["vmax"]
+    for key in ("vmax", "mean", "P10", "P50", "P90"):
+        np.testing.assert_allclose(result[key], vmax, rtol=1e-12, err_msg=key)
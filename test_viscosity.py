@@ -0,0 +1,25 @@
+# Tests of the vectorized cubic equation of state solver against thermo
+# Bhavik Harish Lodhia
+
+import numpy as np
+import pytest
+import data
+import viscosity
+
+###############################################################################
+
+@pytest.mark.parametrize("fluid", ["H2", "H2O"])
+@pytest.mark.parametrize("eos", viscosity.CUBIC)
+def test_cubic_matches_thermo(fluid, eos):
+
+    # random states from 273 to 700 K and 1e2 to 3e8 Pa (none next to a
+    # double root): the same phase as thermo and the same volumes, 
+    # viscosities and densities to 1e-11, the agreement documented for Cubic
+    rng = np.random.default_rng(0)
+    T = rng.uniform(273., 700., 2000)
+    P = 10**rng.uniform(2., np.log10(3e8), 2000)
+    name, Vc = data.Fluid.Name(fluid)
+    result = viscosity.Cubic(name, eos, Vc).check(T, P)
+    assert result.pop("phase") == 0
+    for key, err in result.items():
+        assert err < 1e-11, key
@@ -7,243 +7,993 @@ from thermo.eos_mix import VDWMIX
 from chemicals.viscosity import Lorentz_Bray_Clarke, mu_IAPWS
 from chemicals.iapws import iapws95_rho
 from chemicals import Vm_to_rho
+from fluids.constants import R
+from dataclasses import dataclass
+import json
 import numpy as np
+import cache
+import data
+
+# Quantities returned by Viscosity.Profile and Table.query for each state
+KEYS = ["V_l", "V_g", "mu_l", "mu_g", "rho_l", "rho_g"]
+
+# Viscosity.Pure results keyed on fluid constants, equation, T and P, and the
+# optional T (K) and P (Pa) steps states are rounded to before solving
+_eos_cache = cache.LRU(maxsize=100000)
+_quantize = {"T": None, "P": None}
+
+# IAPWS-95 water density and viscosity keyed on (T, P), and the tabulated
+# IAPWS-95 water properties of Water.Table
+_water_cache = cache.LRU(maxsize=100000)
+_water_table = {}
+
+# Mixing-rule equation of state classes by name
+EOS_MIX = {"PR78": PR78MIX, "TWUPR": TWUPRMIX, "SRK": SRKMIX, "TWUSRK": TWUSRKMIX,
+           "APISRK": APISRKMIX, "RK": RKMIX, "VDW": VDWMIX}
+
+# Solver handles keyed on fluid constants and equation, see Viscosity.Handle
+_solvers = {}
+
+# Equations of state with a vectorized solver (see Cubic), the Cubic handles 
+# keyed as _solvers and whether Viscosity.Profile uses them
+CUBIC = ("PR78", "SRK", "RK", "VDW")
+_cubics = {}
+_vectorize = {"on": True}
+
+# Mixture solvers keyed on fluids, equation and kijs, see Viscosity.Mixture
+_mixtures = {}
+
+# Property tables used by Viscosity.Profile, keyed on (fluid names, equation)
+_tables = {}
+
+
+@dataclass(frozen=True)
+class State:
+
+    # Equation of state solution for one fluid at temperature T (K) and 
+    # pressure P (Pa), as returned by Viscosity.Pure. Volumes (m^3/mol), 
+    # viscosities (Pa s) and densities (kg/m^3) of a phase that is not 
+    # present are NaN
+    names: tuple
+    equation: str
+    phase: str                  # 'l', 'g' or 'l/g'
+    T: float
+    P: float
+    V_l: float
+    V_g: float
+    mu_l: float
+    mu_g: float
+    rho_l: float
+    rho_g: float
+
+
+@dataclass(frozen=True)
+class MixtureState(State):
+
+    # Flash result for a mixture of overall composition zs, see Mixture.at. 
+    # phase is 'l/g' for a two phase split with vapour fraction beta and
+    # liquid and vapour compositions xs and ys; single phase states have beta
+    # 0 ('l') or 1 ('g') and xs = ys = zs
+    zs: tuple
+    beta: float
+    xs: tuple
+    ys: tuple
 
 
 class Viscosity:
 
     def Pure(name, equation, Vc, t, p):
-    
+
+        # Viscosity.Solve through the EOS cache, so identical states (e.g. the 
+        # same depth for different rocks) are only solved once
+        if _quantize["T"]:
+            t = round(t/_quantize["T"])*_quantize["T"]
+        if _quantize["P"]:
+            p = round(p/_quantize["P"])*_quantize["P"]
+
+        key = (tuple(name.names), tuple(name.MWs), tuple(name.Tcs), tuple(name.Pcs),
+               tuple(name.omegas), tuple(Vc), equation, float(t), float(p))
+        visc = _eos_cache.get(key)
+        if visc is None:
+            visc = Viscosity.Solve(name, equation, Vc, t, p)
+            _eos_cache.put(key, visc)
+
+        return visc
+
+    def CacheConfig(maxsize=100000, T_step=None, P_step=None):
+
+        # Size of the EOS cache (None for unbounded) and optional rounding of 
+        # temperature (K) and pressure (Pa) before solving, e.g. T_step=0.01
+        _eos_cache.resize(maxsize)
+        _quantize["T"] = T_step
+        _quantize["P"] = P_step
+
+    def CacheInfo():
+        # hits, misses, size and maxsize of the EOS cache
+        return _eos_cache.info()
+
+    def CacheClear():
+        _eos_cache.clear()
+
+    def Solve(name, equation, Vc, t, p):
+
+        # Solve the equation of state for liquid and gas volumes and calculate
+        # densities and LBC viscosities, see Solver.at
+        return Viscosity.Handle(name, equation, Vc).at(t, p)
+
+    def Handle(name, equation, Vc):
+
+        # Solver for a fluid and equation of state, created once and reused
+        key = (tuple(name.names), tuple(name.MWs), tuple(name.Tcs), tuple(name.Pcs),
+               tuple(name.omegas), tuple(Vc), equation)
+        solver = _solvers.get(key)
+        if solver is None:
+            solver = Solver(name, equation, Vc)
+            _solvers[key] = solver
+
+        return solver
+
+    def Vectorized(name, equation, Vc):
+
+        # Cubic solver for a pure fluid and equation of state in CUBIC, created
+        # once and reused
+        key = (tuple(name.names), tuple(name.MWs), tuple(name.Tcs), tuple(name.Pcs),
+               tuple(name.omegas), tuple(Vc), equation)
+        cubic = _cubics.get(key)
+        if cubic is None:
+            cubic = Cubic(name, equation, Vc)
+            _cubics[key] = cubic
+
+        return cubic
+
+    def Mixture(fluids, equation, kijs=None):
+
+        # Mixture solver for a list of fluid names (see data.Fluid) and 
+        # equation of state, created once and reused
+        key = (tuple(fluids), equation, None if kijs is None else 
+               tuple(tuple(row) for row in kijs))
+        mixture = _mixtures.get(key)
+        if mixture is None:
+            mixture = Mixture(fluids, equation, kijs)
+            _mixtures[key] = mixture
+
+        return mixture
+
+    def Vectorize(on=True):
+        # Solve Viscosity.Profile states of pure fluids with Cubic (default) or,
+        # with on=False, one at a time with thermo through Viscosity.Pure
+        _vectorize["on"] = on
+
+    def Profile(name, equation, Vc, T, P):
+
+        # Viscosity.Pure along a profile of temperatures (K) and pressures (Pa),
+        # solving each distinct (T, P) state once. Returns a dict of arrays with
+        # NaN for quantities of phases that are not present
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float), 
+                                   np.asarray(P, dtype=float))
+
+        # property table mode, see Viscosity.UseTable
+        table = _tables.get((tuple(name.names), equation))
+        if table is not None:
+            return table.query(T, P)
+
+        # all states in one numpy pass, see Cubic
+        if _vectorize["on"] and equation in CUBIC and len(name.names) == 1:
+            return Viscosity.Vectorized(name, equation, Vc).batch(T, P)
+
+        states, inverse = np.unique(np.stack([T.ravel(), P.ravel()], axis=1), 
+                                    axis=0, return_inverse=True)
+
+        cols = {key: np.empty(len(states)) for key in KEYS}
+        phase = np.empty(len(states), dtype="<U3")
+        for i, (t, p) in enumerate(states):
+            visc = Viscosity.Pure(name, equation, Vc, float(t), float(p))
+            phase[i] = visc.phase
+            for key in KEYS:
+                cols[key][i] = getattr(visc, key)
+
+        inverse = inverse.ravel()
+        result = {"T": T, "P": P, "phase": phase[inverse].reshape(T.shape)}
+        for key in KEYS:
+            result[key] = cols[key][inverse].reshape(T.shape)
+        
+        return result
+
+    def UseTable(table):
+        # Answer Viscosity.Profile calls for the table's fluid and equation of 
+        # state from the table
+        _tables[(tuple(table.name.names), table.equation)] = table
+
+    def DropTable(name, equation):
+        # Go back to solving the equation of state for every state
+        _tables.pop((tuple(name.names), equation), None)
+
+    def Mode(name, equation):
+
+        # How Viscosity.Profile answers states of a fluid and equation of 
+        # state, as a tuple for the keys of cached results: from a property
+        # table (its grid and tolerance), with Cubic, or with thermo and the
+        # T and P rounding of Viscosity.CacheConfig
+        table = _tables.get((tuple(name.names), equation))
+        if table is not None:
+            return ("table", table.tol, table.T, table.P)
+        if _vectorize["on"] and equation in CUBIC and len(name.names) == 1:
+            return ("cubic",)
+
+        return ("thermo", _quantize["T"], _quantize["P"])
+
+
+class Solver:
+
+    # Equation of state handle for one pure fluid. The EOS object is built on
+    # the first state and then moved to new states with thermo's 
+    # to_TP_zs_fast, which keeps the composition dependent set up, so along a
+    # profile only the cubic solve is paid per point.
+    #
+    #   solver = Solver(name, "PR78", Vc)
+    #   solver.at(320., 1e7)          # State, as Viscosity.Pure
+    #   solver.to(P=2e7)              # change one of T or P
+    #   solver.batch(T, P)            # same dict as Viscosity.Profile
+
+    def __init__(self, name, equation, Vc):
+
+        if equation not in EOS_MIX:
+            raise ValueError("Unknown equation of state %r, choose from %s" 
+                             % (equation, ", ".join(EOS_MIX)))
+        self.name = name
+        self.equation = equation
+        self.Vc = Vc
+        self.zs = [1.0]
+        self.MW = sum(name.MWs)
+        self.eos = None
+
+    def at(self, t, p):
+
         # Solve EOS to calculate liquid and gas volumes
+        if self.eos is None:
+            self.eos = EOS_MIX[self.equation](T=t, P=p, Tcs=self.name.Tcs, 
+                                              Pcs=self.name.Pcs, 
+                                              omegas=self.name.omegas, zs=self.zs)
+        else:
+            self.eos = self.eos.to_TP_zs_fast(t, p, self.zs)
+        EOS = self.eos
+
+        V_l = V_g = mu_l = mu_g = rhol = rhog = float('nan')
+        if EOS.phase in ('l', 'l/g'):
+            V_l = EOS.V_l
+            rhol = Vm_to_rho(Vm=V_l, MW=self.MW)
+            mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=V_l, zs=self.zs, MWs=self.name.MWs, 
+                                       Tcs=self.name.Tcs, Pcs=self.name.Pcs, Vcs=self.Vc)
+        if EOS.phase in ('g', 'l/g'):
+            V_g = EOS.V_g
+            rhog = Vm_to_rho(Vm=V_g, MW=self.MW)
+            mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=V_g, zs=self.zs, MWs=self.name.MWs, 
+                                       Tcs=self.name.Tcs, Pcs=self.name.Pcs, Vcs=self.Vc)
+
+        return State(tuple(self.name.names), self.equation, EOS.phase, t, p, 
+                     V_l, V_g, mu_l, mu_g, rhol, rhog)
+
+    def to(self, T=None, P=None):
+        # Move to a new state, keeping T or P if not given
+        return self.at(self.eos.T if T is None else T, self.eos.P if P is None else P)
+
+    def batch(self, T, P):
+
+        # Solve arrays of states (no caching), returns a dict of arrays as 
+        # Viscosity.Profile
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float), 
+                                   np.asarray(P, dtype=float))
+        result = {"T": T, "P": P, "phase": np.empty(T.shape, dtype="<U3")}
+        for key in KEYS:
+            result[key] = np.empty(T.shape)
+        for idx in np.ndindex(T.shape):
+            visc = self.at(float(T[idx]), float(P[idx]))
+            result["phase"][idx] = visc.phase
+            for key in KEYS:
+                result[key][idx] = getattr(visc, key)
+
+        return result
+
+
+class Cubic:
+
+    # Vectorized PR78, SRK, RK and VDW equations of state for one pure fluid.
+    # All (T, P) states of a profile are solved in one numpy pass: the cubic
+    # in Z is solved in closed form (Cardano / trigonometric) and polished 
+    # with Newton steps, phases follow thermo's rules (two distinct roots 
+    # above b give 'l/g', a single root is 'l' or 'g' from the phase 
+    # identification parameter) and the LBC viscosity is evaluated on the 
+    # arrays. Agrees with Solver.batch in phase and to 1e-11 (relative) in
+    # all properties, except within a fraction of a kelvin of a double root
+    # (the edge of the three-root region) where the liquid root is ill
+    # conditioned for both solvers, see Cubic.check and test_viscosity.py
+    #
+    #   cubic = Cubic(name, "PR78", Vc)
+    #   cubic.batch(T, P)             # same dict as Viscosity.Profile
+    #   cubic.check(T, P)             # largest differences to Solver.batch
+
+    def __init__(self, name, equation, Vc):
+
+        if equation not in CUBIC:
+            raise ValueError("No vectorized solver for equation of state %r, "
+                             "choose from %s" % (equation, ", ".join(CUBIC)))
+        if len(name.names) != 1:
+            raise ValueError("Cubic only solves pure fluids")
+        self.name = name
+        self.equation = equation
+        self.Vc = Vc
+        self.MW = sum(name.MWs)
+        Tc, Pc, omega = name.Tcs[0], name.Pcs[0], name.omegas[0]
+        self.Tc, self.Pc = Tc, Pc
+
+        # a and b at the critical point, delta and epsilon of 
+        # P = RT/(V - b) - a alpha/(V^2 + delta V + epsilon)
+        eos = EOS_MIX[equation]
+        self.a = eos.c1*R*R*Tc*Tc/Pc
+        self.b = b = eos.c2*R*Tc/Pc
+        self.delta, self.epsilon = {"PR78": (2*b, -b*b), "SRK": (b, 0.), 
+                                    "RK": (b, 0.), "VDW": (0., 0.)}[equation]
+
+        # slope m of the Soave alpha function (1 + m(1 - Tr^0.5))^2
         if equation == "PR78":
-            EOS = PR78MIX(T=t, P=p, Tcs=name.Tcs, Pcs=name.Pcs, omegas=name.omegas, 
-                          zs=[1.0])
-            if EOS.phase == str('l'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                return (name.names, equation, EOS.phase, str('Volume'), p, t,  
-                        EOS.V_l, str('NaN'), mu_l, str('NaN'), str('rhol'), rhol,
-                        str('rhog'), str('NaN'))        
-
-            elif EOS.phase == str('g'):
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)         
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        str('NaN'), EOS.V_g, str('NaN'), mu_g, str('rhol'), 
-                        str('NaN'), str('rhog'), rhog)
-
-
-            elif EOS.phase == str('l/g'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)     
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        EOS.V_l, EOS.V_g, mu_l, mu_g, str('rhol'), rhol,
-                        str('rhog'), rhog)
-
-
-    
-        elif equation == "TWUPR":
-            EOS = TWUPRMIX(T=t, P=p, Tcs=name.Tcs, Pcs=name.Pcs, omegas=name.omegas, 
-                           zs=[1.0])   
-            if EOS.phase == str('l'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)           
-                return (name.names, equation, EOS.phase, str('Volume'), p, t,  
-                        EOS.V_l, str('NaN'), mu_l, str('NaN'), str('rhol'), rhol,
-                        str('rhog'), str('NaN'))
-            elif EOS.phase == str('g'):
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)         
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        str('NaN'), EOS.V_g, str('NaN'), mu_g, str('rhol'), 
-                        str('NaN'), str('rhog'), rhog)
-            elif EOS.phase == str('l/g'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)               
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        EOS.V_l, EOS.V_g, mu_l, mu_g, str('rhol'), rhol,
-                        str('rhog'), rhog)           
-    
+            if omega > 0.491:
+                self.m = omega*(omega*(0.016666*omega - 0.164423) + 1.48503) + 0.379642
+            else:
+                self.m = omega*(-0.26992*omega + 1.54226) + 0.37464
         elif equation == "SRK":
-            EOS = SRKMIX(T=t, P=p, Tcs=name.Tcs, Pcs=name.Pcs, omegas=name.omegas, 
-                         zs=[1.0])
-            if EOS.phase == str('l'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                return (name.names, equation, EOS.phase, str('Volume'), p, t,  
-                        EOS.V_l, str('NaN'), mu_l, str('NaN'), str('rhol'), rhol,
-                        str('rhog'), str('NaN'))
-            elif EOS.phase == str('g'):
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)         
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        str('NaN'), EOS.V_g, str('NaN'), mu_g, str('rhol'), 
-                        str('NaN'), str('rhog'), rhog)
-            elif EOS.phase == str('l/g'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)              
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        EOS.V_l, EOS.V_g, mu_l, mu_g, str('rhol'), rhol,
-                        str('rhog'), rhog)    
-    
-        elif equation == "TWUSRK":
-            EOS = TWUSRKMIX(T=t, P=p, Tcs=name.Tcs, Pcs=name.Pcs, omegas=name.omegas, 
-                            zs=[1.0])
-            if EOS.phase == str('l'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                return (name.names, equation, EOS.phase, str('Volume'), p, t,  
-                        EOS.V_l, str('NaN'), mu_l, str('NaN'), str('rhol'), rhol,
-                        str('rhog'), str('NaN'))
-            elif EOS.phase == str('g'):
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)         
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        str('NaN'), EOS.V_g, str('NaN'), mu_g, str('rhol'), 
-                        str('NaN'), str('rhog'), rhog)
-            elif EOS.phase == str('l/g'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)              
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        EOS.V_l, EOS.V_g, mu_l, mu_g, str('rhol'), rhol,
-                        str('rhog'), rhog)   
-   
-        elif equation == "APISRK":
-            EOS = APISRKMIX(T=t, P=p, Tcs=name.Tcs, Pcs=name.Pcs, omegas=name.omegas, 
-                            zs=[1.0]) 
-            if EOS.phase == str('l'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                return (name.names, equation, EOS.phase, str('Volume'), p, t,  
-                        EOS.V_l, str('NaN'), mu_l, str('NaN'), str('rhol'), rhol,
-                        str('rhog'), str('NaN'))
-            elif EOS.phase == str('g'):
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)         
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        str('NaN'), EOS.V_g, str('NaN'), mu_g, str('rhol'), 
-                        str('NaN'), str('rhog'), rhog)
-            elif EOS.phase == str('l/g'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)               
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        EOS.V_l, EOS.V_g, mu_l, mu_g, str('rhol'), rhol,
-                        str('rhog'), rhog)   
-    
-        elif equation == "RK":
-            EOS = RKMIX(T=t, P=p, Tcs=name.Tcs, Pcs=name.Pcs, omegas=name.omegas, 
-                        zs=[1.0])
-            if EOS.phase == str('l'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                return (name.names, equation, EOS.phase, str('Volume'), p, t,  
-                        EOS.V_l, str('NaN'), mu_l, str('NaN'), str('rhol'), rhol,
-                        str('rhog'), str('NaN'))
-            elif EOS.phase == str('g'):
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)         
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        str('NaN'), EOS.V_g, str('NaN'), mu_g, str('rhol'), 
-                        str('NaN'), str('rhog'), rhog)
-            elif EOS.phase == str('l/g'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)               
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        EOS.V_l, EOS.V_g, mu_l, mu_g, str('rhol'), rhol,
-                        str('rhog'), rhog)   
-    
-        elif equation == "VDW":
-            EOS = VDWMIX(T=t, P=p, Tcs=name.Tcs, Pcs=name.Pcs, omegas=name.omegas, 
-                         zs=[1.0])
-            if EOS.phase == str('l'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc) 
-                return (name.names, equation, EOS.phase, str('Volume'), p, t,  
-                        EOS.V_l, str('NaN'), mu_l, str('NaN'), str('rhol'), rhol,
-                        str('rhog'), str('NaN'))
-            elif EOS.phase == str('g'):
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)         
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        str('NaN'), EOS.V_g, str('NaN'), mu_g, str('rhol'), 
-                        str('NaN'), str('rhog'), rhog)
-            elif EOS.phase == str('l/g'):
-                rhol = Vm_to_rho(Vm=EOS.V_l, MW=sum(name.MWs))
-                rhog = Vm_to_rho(Vm=EOS.V_g, MW=sum(name.MWs))
-                mu_l = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_l, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)
-                mu_g = Lorentz_Bray_Clarke(T=t, P=p, Vm=EOS.V_g, zs=[1.0], MWs=name.MWs, 
-                                           Tcs=name.Tcs, Pcs=name.Pcs, Vcs=Vc)               
-                return (name.names, equation, EOS.phase, str('Volume'), p, t, 
-                        EOS.V_l, EOS.V_g, mu_l, mu_g, str('rhol'), rhol,
-                        str('rhog'), rhog)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+            self.m = omega*(1.574 - 0.176*omega) + 0.480
+
+        # LBC reducing parameter, Pc in atm
+        self.xi = Tc**(1/6)*self.MW**-0.5*(Pc/101325.)**(-2/3)
+
+    def alpha(self, T):
+
+        # a alpha and its temperature derivative
+        if self.equation in ("PR78", "SRK"):
+            s = 1 + self.m*(1 - np.sqrt(T/self.Tc))
+            return self.a*s*s, -self.a*self.m*s/np.sqrt(T*self.Tc)
+        elif self.equation == "RK":
+            a_alpha = self.a*np.sqrt(self.Tc/T)
+            return a_alpha, -0.5*a_alpha/T
+        return np.full(T.shape, self.a), np.zeros(T.shape)
+
+    def roots(self, T, P, a_alpha):
+
+        # Roots of the cubic in Z as a (3, n) array, NaN for complex roots
+        RT = R*T
+        B = self.b*P/RT
+        A = a_alpha*P/(RT*RT)
+        D = self.delta*P/RT
+        E = self.epsilon*P*P/(RT*RT)
+        c2 = D - B - 1
+        c1 = A + E - D*(B + 1)
+        c0 = -(E*(B + 1) + A*B)
+
+        # depressed cubic x^3 + px + q with Z = x - c2/3. The largest root is
+        # the Cardano root for a positive discriminant (one real root) and the
+        # first trigonometric root otherwise (three real roots), the other two
+        # follow from the remaining quadratic
+        p = c1 - c2*c2/3
+        q = (2/27*c2*c2 - c1/3)*c2 + c0
+        disc = q*q/4 + p*p*p/27
+        one = disc > 0
+        sq = np.sqrt(np.maximum(disc, 0.))
+        r = np.sqrt(np.maximum(-p/3, 0.))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            cos = np.clip(-q/(2*r*r*r), -1., 1.)
+        trig = 2*r*np.cos(np.arccos(np.where(one | (r == 0), 1., cos))/3)
+        Z = np.empty((3,) + T.shape)
+        Z[0] = np.where(one, np.cbrt(-q/2 + sq) + np.cbrt(-q/2 - sq), trig) - c2/3
+        Z[0] = Cubic.newton(Z[0], c2, c1, c0)
+
+        # Z^2 + bq Z + cq = 0, solved in the cancellation free form
+        bq = c2 + Z[0]
+        cq = c1 + Z[0]*bq
+        s = -(bq + np.copysign(np.sqrt(np.maximum(bq*bq - 4*cq, 0.)), bq))/2
+        with np.errstate(invalid="ignore", divide="ignore"):
+            Z[1] = np.where(one, np.nan, s)
+            Z[2] = np.where(one, np.nan, cq/s)
+            Z[1:] = Cubic.newton(Z[1:], c2, c1, c0)
+
+        return Z
+
+    def newton(Z, c2, c1, c0):
+        # Two Newton steps on Z^3 + c2 Z^2 + c1 Z + c0 = 0
+        for i in range(2):
+            f = ((Z + c2)*Z + c1)*Z + c0
+            df = (3*Z + 2*c2)*Z + c1
+            with np.errstate(invalid="ignore", divide="ignore"):
+                step = f/df
+            Z = np.where(df != 0, Z - step, Z)
+        return Z
+
+    def pip(self, T, V, a_alpha, da_alpha):
+
+        # Phase identification parameter, liquid above 1
+        d = V*V + self.delta*V + self.epsilon
+        x = 2*V + self.delta
+        Vb = V - self.b
+        dP_dT = R/Vb - da_alpha/d
+        dP_dV = -R*T/(Vb*Vb) + a_alpha*x/(d*d)
+        d2P_dV2 = 2*R*T/Vb**3 + a_alpha*(2/(d*d) - 2*x*x/d**3)
+        d2P_dTdV = -R/(Vb*Vb) + da_alpha*x/(d*d)
+
+        return V*(d2P_dTdV/dP_dT - d2P_dV2/dP_dV)
+
+    def mu(self, T, V):
+
+        # Lorentz-Bray-Clarke viscosity (Pa s) with the Stiel-Thodos low 
+        # pressure gas viscosity, as chemicals.viscosity.Lorentz_Bray_Clarke
+        Tr = T/self.Tc
+        mu_low = np.where(Tr > 1.5, 17.78e-5*np.maximum(4.58*Tr - 1.67, 0.)**0.625,
+                          34e-5*Tr**0.94)/self.xi
+        rhor = self.Vc[0]/V
+        poly = rhor*(rhor*(rhor*(0.0093724*rhor - 0.040758) + 0.058533) + 0.023364) + 0.1023
+        poly2 = poly*poly
+
+        return (mu_low*self.xi + poly2*poly2 - 0.0001)/self.xi*1e-3
+
+    def solve(self, t, p):
+
+        # Phase and the KEYS quantities for 1-d arrays of states
+        a_alpha, da_alpha = self.alpha(t)
+        V = self.roots(t, p, a_alpha)*(R*t/p)
+
+        # acceptable roots are real and above b
+        good = V > self.b
+        count = good.sum(axis=0)
+        if (count == 0).any():
+            i = np.argmin(count)
+            raise ValueError("No acceptable roots were found, T is %s K, P is %s Pa"
+                             % (t[i], p[i]))
+        Vmin = np.where(good, V, np.inf).min(axis=0)
+        Vmax = np.where(good, V, -np.inf).max(axis=0)
+
+        two = (count > 1) & (Vmin != Vmax)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            liquid = self.pip(t, Vmin, a_alpha, da_alpha) > 1.00000000000001
+        critical = (t == self.Tc) & (p == self.Pc)
+        phase = np.where(two | critical, "l/g", np.where(liquid, "l", "g"))
+
+        V_l = np.where(two | critical | liquid, Vmin, np.nan)
+        V_g = np.where(two, Vmax, np.where(critical | ~liquid, Vmin, np.nan))
+
+        return (phase, V_l, V_g, self.mu(t, V_l), self.mu(t, V_g), 
+                self.MW/V_l*1e-3, self.MW/V_g*1e-3)
+
+    def batch(self, T, P, chunk=8192):
+
+        # Solve arrays of states, returns a dict of arrays as Viscosity.Profile.
+        # States are solved chunk at a time so the temporaries stay in cache
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float), 
+                                   np.asarray(P, dtype=float))
+        t, p = T.ravel(), P.ravel()
+        phase = np.empty(t.shape, dtype="<U3")
+        cols = [np.empty(t.shape) for key in KEYS]
+        for s in range(0, len(t), chunk):
+            out = self.solve(t[s:s + chunk], p[s:s + chunk])
+            phase[s:s + chunk] = out[0]
+            for col, value in zip(cols, out[1:]):
+                col[s:s + chunk] = value
+
+        result = {"T": T, "P": P, "phase": phase.reshape(T.shape)}
+        for key, col in zip(KEYS, cols):
+            result[key] = col.reshape(T.shape)
+
+        return result
+
+    def check(self, T, P):
+
+        # Largest relative difference of each quantity to thermo (Solver.batch)
+        # and the number of states with a different phase
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float), 
+                                   np.asarray(P, dtype=float))
+        fast = self.batch(T, P)
+        exact = Solver(self.name, self.equation, self.Vc).batch(T, P)
+        same = fast["phase"] == exact["phase"]
+        result = {"phase": int((~same).sum())}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for key in KEYS:
+                err = np.abs(fast[key] - exact[key])/np.abs(exact[key])
+                result[key] = float(np.nanmax(np.where(same, err, np.nan), 
+                                              initial=0.))
+
+        return result
+
+
+class Mixture:
+
+    # Equation of state, two phase flash and LBC viscosity for mixtures of
+    # the fluids in data/fluids.csv, e.g. H2-CH4-CO2-N2, with the binary
+    # interaction parameters of data/kij.csv unless kijs is given. Flashes
+    # start from Wilson K values, find the vapour fraction with 
+    # Rachford-Rice and refine K by successive substitution on the EOS 
+    # fugacity coefficients. The EOS of each composition is kept (up to 
+    # cache_size compositions) and moved between states with to_TP_zs_fast,
+    # so the composition dependent mixing terms are set up once.
+    #
+    #   mixture = Viscosity.Mixture(["H2", "CH4", "CO2"], "PR78")
+    #   mixture.at(320., 1e7, [0.8, 0.15, 0.05])   # MixtureState
+    #   mixture.grid(T, P, zs)     # dict of (compositions, states) arrays
+
+    def __init__(self, fluids, equation, kijs=None, cache_size=1000):
+
+        if equation not in EOS_MIX:
+            raise ValueError("Unknown equation of state %r, choose from %s" 
+                             % (equation, ", ".join(EOS_MIX)))
+        self.fluids = list(fluids)
+        self.equation = equation
+        constants = [data.Fluid.Name(fluid) for fluid in self.fluids]
+        self.names = tuple(name.names[0] for name, Vc in constants)
+        self.MWs = [name.MWs[0] for name, Vc in constants]
+        self.Tcs = [name.Tcs[0] for name, Vc in constants]
+        self.Pcs = [name.Pcs[0] for name, Vc in constants]
+        self.omegas = [name.omegas[0] for name, Vc in constants]
+        self.Vcs = [Vc[0] for name, Vc in constants]
+        self.kijs = data.Fluid.Kij(self.fluids) if kijs is None else kijs
+        self.eoss = cache.LRU(cache_size)
+        self.work = None
+
+    def eos(self, t, p, zs, keep=False):
+
+        # EOS at a state. Overall compositions (keep=True) keep their own EOS,
+        # trial phase compositions of the flash move one working EOS; both 
+        # go through to_TP_zs_fast, which reuses the pure component terms
+        key = tuple(zs)
+        eos = self.eoss.get(key) if keep else self.work
+        if eos is None:
+            eos = EOS_MIX[self.equation](T=t, P=p, Tcs=self.Tcs, Pcs=self.Pcs, 
+                                         omegas=self.omegas, zs=list(zs), 
+                                         kijs=self.kijs)
+        else:
+            eos = eos.to_TP_zs_fast(t, p, list(zs))
+        if keep:
+            self.eoss.put(key, eos)
+        else:
+            self.work = eos
+
+        return eos
+
+    def lnphis(self, t, p, zs, phase):
+
+        # log fugacity coefficients and molar volume of the liquid ('l') or 
+        # vapour ('g') root, the other root if only one exists
+        eos = self.eos(t, p, zs)
+        eos.fugacities()                # not set by to_TP_zs_fast
+        if phase == 'l' and eos.phase != 'g' or eos.phase == 'l':
+            return eos.lnphis_l, eos.V_l
+        return eos.lnphis_g, eos.V_g
+
+    def volume(self, t, p, zs, phase, keep=False):
+        # molar volume of the liquid or vapour root as in Mixture.lnphis
+        eos = self.eos(t, p, zs, keep)
+        if phase == 'l' and eos.phase != 'g' or eos.phase == 'l':
+            return eos.V_l
+        return eos.V_g
+
+    def rachford_rice(zs, K):
+
+        # Vapour fraction beta of the Rachford-Rice equation by bisection on 
+        # the range where all phase compositions are positive, negative or
+        # above 1 when no two phase solution exists
+        zs, K = np.asarray(zs), np.asarray(K)
+        f = lambda beta: float(np.sum(zs*(K - 1)/(1 + beta*(K - 1))))
+        if f(0.) <= 0:
+            return -1.
+        if f(1.) >= 0:
+            return 2.
+        lo, hi = 0., 1.
+        for i in range(100):
+            mid = (lo + hi)/2
+            if f(mid) > 0:
+                lo = mid
+            else:
+                hi = mid
+            if hi - lo < 1e-14:
+                break
+
+        return (lo + hi)/2
+
+    def wilson(self, t, p):
+        # Wilson (1968) K values
+        return (np.array(self.Pcs)/p*np.exp(5.373*(1 + np.array(self.omegas))*
+                                             (1 - np.array(self.Tcs)/t)))
+
+    def feed(self, t, p, zs):
+
+        # The overall composition as a single phase: True for vapour (lower
+        # Gibbs energy root when there are two) and its log fugacity 
+        # coefficients
+        eos = self.eos(t, p, zs, keep=True)
+        if eos.phase == 'l/g':
+            gas = eos.G_dep_g <= eos.G_dep_l
+        else:
+            gas = eos.phase == 'g'
+        eos.fugacities()
+
+        return gas, np.array(eos.lnphis_g if gas else eos.lnphis_l)
+
+    def substitute(self, t, p, zs, K, tol=1e-10, maxiter=200):
+
+        # Successive substitution from K values, returns beta, xs, ys and K 
+        # of a two phase solution or None
+        for i in range(maxiter):
+            beta = Mixture.rachford_rice(zs, K)
+            if not 0 < beta < 1:
+                return None
+            xs = zs/(1 + beta*(K - 1))
+            ys = K*xs
+            xs, ys = xs/xs.sum(), ys/ys.sum()
+            lnphis_l = self.lnphis(t, p, xs, 'l')[0]
+            lnphis_g = self.lnphis(t, p, ys, 'g')[0]
+            K_new = np.exp(np.array(lnphis_l) - np.array(lnphis_g))
+            converged = np.abs(K_new - K).max() < tol*np.abs(K).max()
+            K = K_new
+            if np.abs(np.log(K)).sum() < 1e-4:
+                return None             # trivial solution, single phase
+            if converged:
+                return beta, xs, ys, K
+
+        return None
+
+    def stability(self, t, p, zs, tol=1e-8, maxiter=200):
+
+        # Michelsen (1982) tangent plane test with vapour and liquid like 
+        # trial phases from Wilson K values. Returns K values to flash from
+        # if the single phase is unstable, else None
+        gas, lnphis_z = self.feed(t, p, zs)
+        d = np.log(np.maximum(zs, 1e-300)) + lnphis_z
+        Kw = self.wilson(t, p)
+        for phase, W in (('g', zs*Kw), ('l', zs/Kw)):
+            for i in range(maxiter):
+                lnphis_w = self.lnphis(t, p, W/W.sum(), phase)[0]
+                W_new = np.exp(d - np.array(lnphis_w))
+                converged = np.abs(W_new - W).max() < tol*W_new.max()
+                W = W_new
+                trivial = np.abs(np.log(np.maximum(W/W.sum(), 1e-300)/
+                                        np.maximum(zs, 1e-300))).sum() < 1e-4
+                if converged or trivial:
+                    break
+            if W.sum() > 1 + 1e-8 and not trivial:
+                return W/zs if phase == 'g' else zs/W
+
+        return None
+
+    def flash(self, t, p, zs, K=None):
+
+        # Two phase PT flash: returns beta, xs, ys and K. beta is 0 or 1 
+        # (xs = ys = zs) for single phase states. Successive substitution 
+        # starts from K (e.g. the K values of a nearby state) or Wilson K 
+        # values; if that finds no split the stability test decides
+        zs = np.asarray(zs, dtype=float)
+        K = self.wilson(t, p) if K is None else np.asarray(K, dtype=float)
+        result = self.substitute(t, p, zs, K)
+        if result is None:
+            K = self.stability(t, p, zs)
+            if K is not None:
+                result = self.substitute(t, p, zs, K)
+        if result is not None:
+            return result
+
+        gas = self.feed(t, p, zs)[0]
+
+        return (1. if gas else 0.), zs, zs, K
+
+    def at(self, t, p, zs):
+
+        # Flash a mixture of overall composition zs at t (K) and p (Pa), 
+        # densities and LBC viscosities of the phases present
+        zs = np.asarray(zs, dtype=float)
+        zs = zs/zs.sum()
+        beta, xs, ys, K = self.flash(t, p, zs)
+
+        return self.state(t, p, zs, beta, xs, ys)
+
+    def state(self, t, p, zs, beta, xs, ys):
+
+        # Densities and viscosities of the phases of a flash result
+        single = not 0 < beta < 1
+        V_l = V_g = mu_l = mu_g = rhol = rhog = float('nan')
+        if beta < 1:
+            V_l = float(self.volume(t, p, xs, 'l', single))
+            MW = float(np.dot(xs, self.MWs))
+            rhol = float(Vm_to_rho(Vm=V_l, MW=MW))
+            mu_l = float(Lorentz_Bray_Clarke(T=t, P=p, Vm=V_l, zs=list(xs), MWs=self.MWs,
+                                             Tcs=self.Tcs, Pcs=self.Pcs, Vcs=self.Vcs))
+        if beta > 0:
+            V_g = float(self.volume(t, p, ys, 'g', single))
+            MW = float(np.dot(ys, self.MWs))
+            rhog = float(Vm_to_rho(Vm=V_g, MW=MW))
+            mu_g = float(Lorentz_Bray_Clarke(T=t, P=p, Vm=V_g, zs=list(ys), MWs=self.MWs,
+                                             Tcs=self.Tcs, Pcs=self.Pcs, Vcs=self.Vcs))
+        phase = 'l/g' if not single else ('g' if beta >= 1 else 'l')
+
+        return MixtureState(self.names, self.equation, phase, t, p, V_l, V_g, 
+                            mu_l, mu_g, rhol, rhog, tuple(zs.tolist()), float(beta),
+                            tuple(np.asarray(xs).tolist()), 
+                            tuple(np.asarray(ys).tolist()))
+
+    def grid(self, T, P, zs):
+
+        # Flash every composition (rows of zs) at every state (T, P arrays of 
+        # the same shape, e.g. a depth profile). Returns a dict of arrays of
+        # shape (compositions,) + T.shape with phase, beta and KEYS. Along a
+        # profile the K values of the previous state start the next flash
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float), 
+                                   np.asarray(P, dtype=float))
+        zs = np.atleast_2d(np.asarray(zs, dtype=float))
+        zs = zs/zs.sum(axis=1, keepdims=True)
+        shape = (len(zs),) + T.shape
+        result = {"T": T, "P": P, "zs": zs, "phase": np.empty(shape, dtype="<U3"),
+                  "beta": np.empty(shape)}
+        for key in KEYS:
+            result[key] = np.empty(shape)
+
+        for c, z in enumerate(zs):
+            K = None
+            for idx in np.ndindex(T.shape):
+                t, p = float(T[idx]), float(P[idx])
+                beta, xs, ys, K_new = self.flash(t, p, z, K)
+                # keep two phase K values only, Wilson is a better start 
+                # than a single phase trivial solution
+                K = K_new if 0 < beta < 1 else None
+                visc = self.state(t, p, z, beta, xs, ys)
+                result["phase"][(c,) + idx] = visc.phase
+                result["beta"][(c,) + idx] = visc.beta
+                for key in KEYS:
+                    result[key][(c,) + idx] = getattr(visc, key)
+
+        return result
+
+
+class Table:
+
+    # Viscosity.Pure results tabulated on a (T, P) grid for one fluid and 
+    # equation of state. Queries are answered by bilinear interpolation; 
+    # states near a phase boundary (cells whose corners are not all in the
+    # same phase), outside the grid or in cells whose interpolation error 
+    # exceeds tol are solved exactly instead.
+    #
+    #   table = Table(name, "PR78", Vc, np.linspace(290, 400, 111), 
+    #                 np.linspace(1e5, 5e7, 200), tol=1e-3)
+    #   table.save("h2_pr78.npz")
+    #   Viscosity.UseTable(Table.load("h2_pr78.npz"))
+
+    def __init__(self, name, equation, Vc, T, P, tol=1e-3, grid=None):
+
+        self.name = name
+        self.equation = equation
+        self.Vc = Vc
+        self.T = np.asarray(T, dtype=float)           # temperatures in K
+        self.P = np.asarray(P, dtype=float)           # pressures in Pa
+        self.tol = tol
+        if (len(self.T) < 2 or len(self.P) < 2 or np.any(np.diff(self.T) <= 0) 
+                or np.any(np.diff(self.P) <= 0)):
+            raise ValueError("Table T and P grids must be increasing with at "
+                             "least two points")
+        
+        if grid is None:
+            Tg, Pg = np.meshgrid(self.T, self.P, indexing="ij")
+            grid = self.solve(Tg, Pg)
+            grid["exact"] = self.check(grid, tol)
+
+        self.phase = grid["phase"]
+        self.values = {key: grid[key] for key in KEYS}
+        self.exact = grid["exact"]
+
+    def check(self, grid, tol):
+
+        # Flag cells that must be solved exactly: corners in different phases, 
+        # or interpolation error at the cell centre above tol (relative)
+        phase = grid["phase"]
+        exact = ((phase[:-1, :-1] != phase[1:, :-1]) | 
+                 (phase[:-1, :-1] != phase[:-1, 1:]) | 
+                 (phase[:-1, :-1] != phase[1:, 1:]))
+        if tol is None:
+            return exact
+
+        Tm = (self.T[:-1] + self.T[1:])/2
+        Pm = (self.P[:-1] + self.P[1:])/2
+        Tg, Pg = np.meshgrid(Tm, Pm, indexing="ij")
+        mid = self.solve(Tg, Pg)
+        exact |= mid["phase"] != phase[:-1, :-1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for key in KEYS:
+                v = grid[key]
+                interp = (v[:-1, :-1] + v[1:, :-1] + v[:-1, 1:] + v[1:, 1:])/4
+                err = np.abs(interp - mid[key])/np.abs(mid[key])
+                exact |= np.isfinite(mid[key]) & ~(err <= tol)
+
+        return exact
+
+    def query(self, T, P):
+
+        # Same output as Viscosity.Profile for arrays of T (K) and P (Pa)
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float), 
+                                   np.asarray(P, dtype=float))
+        t, p = T.ravel(), P.ravel()
+        i = np.clip(np.searchsorted(self.T, t, side="right") - 1, 0, len(self.T) - 2)
+        j = np.clip(np.searchsorted(self.P, p, side="right") - 1, 0, len(self.P) - 2)
+        outside = ((t < self.T[0]) | (t > self.T[-1]) | 
+                   (p < self.P[0]) | (p > self.P[-1]))
+        solve = outside | self.exact[i, j]
+
+        # bilinear weights
+        wt = (t - self.T[i])/(self.T[i + 1] - self.T[i])
+        wp = (p - self.P[j])/(self.P[j + 1] - self.P[j])
+        result = {"T": T, "P": P}
+        phase = self.phase[i, j]
+        for key in KEYS:
+            v = self.values[key]
+            result[key] = ((1 - wt)*(1 - wp)*v[i, j] + wt*(1 - wp)*v[i + 1, j] + 
+                           (1 - wt)*wp*v[i, j + 1] + wt*wp*v[i + 1, j + 1])
+
+        if solve.any():
+            phase = phase.copy()
+            exact = self.solve(t[solve], p[solve])
+            phase[solve] = exact["phase"]
+            for key in KEYS:
+                result[key][solve] = exact[key]
+
+        result["phase"] = phase.reshape(T.shape)
+        for key in KEYS:
+            result[key] = result[key].reshape(T.shape)
+        
+        return result
+
+    def solve(self, T, P):
+        # Exact solution, bypassing any table registered for this fluid
+        table = _tables.pop((tuple(self.name.names), self.equation), None)
+        try:
+            return Viscosity.Profile(self.name, self.equation, self.Vc, T, P)
+        finally:
+            if table is not None:
+                _tables[(tuple(self.name.names), self.equation)] = table
+
+    def save(self, path):
+
+        # Store the table as a numpy .npz file together with the fluid constants
+        meta = {"names": list(self.name.names), "MWs": list(self.name.MWs), 
+                "Tcs": list(self.name.Tcs), "Pcs": list(self.name.Pcs), 
+                "omegas": list(self.name.omegas), "Vc": list(self.Vc), 
+                "equation": self.equation, "tol": self.tol}
+        np.savez_compressed(path, T=self.T, P=self.P, phase=self.phase, 
+                            exact=self.exact, meta=json.dumps(meta), 
+                            **self.values)
+
+    def load(path):
+
+        # Read a table written by Table.save
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            name = ChemicalConstantsPackage(MWs=meta["MWs"], names=meta["names"], 
+                                            omegas=meta["omegas"], Pcs=meta["Pcs"],
+                                            Tcs=meta["Tcs"])
+            grid = {key: f[key] for key in KEYS + ["phase", "exact"]}
+            return Table(name, meta["equation"], meta["Vc"], f["T"], f["P"], 
+                         tol=meta["tol"], grid=grid)
+
+
+class Water:
+
+    # Formation water density (kg/m^3) and viscosity (Pa s) at temperature T (K)
+    # and pressure P (Pa), scalars or numpy arrays, without the rock path.
+    # mode "eos" solves the cubic equation of state EOS as Mobility.Mobility 
+    # did for "H2O" (liquid density for 'l/g' states), "iapws" uses IAPWS-95 
+    # (cached per state) and "table" interpolates a Water.Table of IAPWS-95 
+    # values
+
+    def Density(T, P, mode="eos", EOS="PR78"):
+        return Water.Properties(T, P, mode, EOS)[0]
+
+    def Viscosity(T, P, mode="eos", EOS="PR78"):
+        return Water.Properties(T, P, mode, EOS)[1]
+
+    def Properties(T, P, mode="eos", EOS="PR78"):
+
+        # density and viscosity arrays (floats for scalar T and P)
+        scalar = np.ndim(T) == 0 and np.ndim(P) == 0
+        T, P = np.broadcast_arrays(np.asarray(T, dtype=float), 
+                                   np.asarray(P, dtype=float))
+        if mode == "eos":
+            name, Vc = data.Fluid.Name("H2O")
+            h2o = Viscosity.Profile(name, EOS, Vc, T, P)
+            gas = h2o["phase"] == 'g'
+            rho = np.where(gas, h2o["rho_g"], h2o["rho_l"])
+            mu = np.where(gas, h2o["mu_g"], h2o["mu_l"])
+        elif mode == "iapws":
+            rho, mu = Water.IAPWS(T.ravel(), P.ravel())
+        elif mode == "table":
+            rho, mu = Water.Interpolate(T.ravel(), P.ravel())
+        else:
+            raise ValueError("Unknown water property mode %r, choose from "
+                             "'eos', 'iapws' or 'table'" % (mode,))
+
+        rho = np.reshape(rho, T.shape)
+        mu = np.reshape(mu, T.shape)
+        if scalar:
+            return float(rho), float(mu)
+        return rho, mu
+
+    def Mode(mode="eos", EOS="PR78"):
+
+        # How Water.Properties answers states, as a tuple for the keys of 
+        # cached results (see Viscosity.Mode)
+        if mode == "eos":
+            name, Vc = data.Fluid.Name("H2O")
+            return ("eos",) + Viscosity.Mode(name, EOS)
+        if mode == "table":
+            if not _water_table:
+                Water.Table()
+            return ("table", _water_table["T"], _water_table["P"], 
+                    _water_table["exact"])
+
+        return (mode,)
+
+    def IAPWS(T, P):
+
+        # IAPWS-95 density and IAPWS (2008) viscosity for 1-d arrays of states,
+        # each distinct state solved once
+        rho = np.empty(len(T))
+        mu = np.empty(len(T))
+        for i, (t, p) in enumerate(zip(T.tolist(), P.tolist())):
+            state = _water_cache.get((t, p))
+            if state is None:
+                r = iapws95_rho(t, p)
+                state = (r, mu_IAPWS(t, r))
+                _water_cache.put((t, p), state)
+            rho[i], mu[i] = state
+
+        return rho, mu
+
+    def Table(T=None, P=None, tol=1e-3):
+
+        # Tabulate IAPWS-95 water on a (T, P) grid, by default 273.16-623.15 K
+        # and 0.1-150 MPa. Cells crossing the saturation line (corners on both
+        # sides of the critical density) or whose centre interpolation error
+        # exceeds tol (relative) are answered exactly by Water.Interpolate
+        T = np.linspace(273.16, 623.15, 176) if T is None else np.asarray(T, float)
+        P = np.linspace(1e5, 1.5e8, 151) if P is None else np.asarray(P, float)
+        Tg, Pg = np.meshgrid(T, P, indexing="ij")
+        rho, mu = Water.IAPWS(Tg.ravel(), Pg.ravel())
+        rho = rho.reshape(Tg.shape)
+        mu = mu.reshape(Tg.shape)
+
+        liquid = rho > 322.0            # critical density of water
+        exact = ((liquid[:-1, :-1] != liquid[1:, :-1]) | 
+                 (liquid[:-1, :-1] != liquid[:-1, 1:]) | 
+                 (liquid[:-1, :-1] != liquid[1:, 1:]))
+        Tm, Pm = np.meshgrid((T[:-1] + T[1:])/2, (P[:-1] + P[1:])/2, indexing="ij")
+        rho_m, mu_m = Water.IAPWS(Tm.ravel(), Pm.ravel())
+        for v, vm in ((rho, rho_m), (mu, mu_m)):
+            interp = (v[:-1, :-1] + v[1:, :-1] + v[:-1, 1:] + v[1:, 1:])/4
+            exact |= np.abs(interp - vm.reshape(Tm.shape)) > tol*np.abs(vm.reshape(Tm.shape))
+
+        _water_table.clear()
+        _water_table.update({"T": T, "P": P, "rho": rho, "mu": mu, "exact": exact})
+
+    def Interpolate(T, P):
+
+        # Bilinear interpolation in the water table (built on first use), with 
+        # exact IAPWS-95 values outside the table and in flagged cells
+        if not _water_table:
+            Water.Table()
+        Tt, Pt = _water_table["T"], _water_table["P"]
+        i = np.clip(np.searchsorted(Tt, T, side="right") - 1, 0, len(Tt) - 2)
+        j = np.clip(np.searchsorted(Pt, P, side="right") - 1, 0, len(Pt) - 2)
+        wt = (T - Tt[i])/(Tt[i + 1] - Tt[i])
+        wp = (P - Pt[j])/(Pt[j + 1] - Pt[j])
+
+        out = []
+        for key in ("rho", "mu"):
+            v = _water_table[key]
+            out.append((1 - wt)*(1 - wp)*v[i, j] + wt*(1 - wp)*v[i + 1, j] + 
+                       (1 - wt)*wp*v[i, j + 1] + wt*wp*v[i + 1, j + 1])
+        rho, mu = out
+
+        solve = ((T < Tt[0]) | (T > Tt[-1]) | (P < Pt[0]) | (P > Pt[-1]) | 
+                 _water_table["exact"][i, j])
+        if solve.any():
+            rho[solve], mu[solve] = Water.IAPWS(T[solve], P[solve])
+
+        return rho, mu
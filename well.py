@@ -0,0 +1,249 @@
+# Well logs and stratigraphic columns as input to the Mobility calculation
+# Bhavik Harish Lodhia
+
+import os
+import csv
+import itertools
+import numpy as np
+import pandas as pd
+import data
+import grid
+import output as results
+
+# Depth units of LAS files and their factor to km
+UNITS = {"M": 0.001, "F": 0.0003048, "FT": 0.0003048, "KM": 1.0}
+
+###############################################################################
+
+class Well:
+
+    # Wells are read from depth-interval lithology logs and evaluated in
+    # batches across wells. Two formats are read, line by line:
+    #
+    # csv with a header row and the columns well (optional, the file name
+    # otherwise), rock and either depth (one sample per row) or top and base
+    # (an interval sampled every step km from top), depths in km unless scale
+    # is given, e.g.
+    #
+    #   well,top,base,rock
+    #   W-1,0.0,0.35,Sandstone
+    #   W-1,0.35,0.5,Shale
+    #
+    # LAS 2.0 files (~Well, ~Curve and ~A sections) with a depth curve (DEPT
+    # or DEPTH, unit from the ~Curve section) and a lithology curve holding
+    # rock names, rock ids or codes translated by codes (e.g. {1:
+    # "Sandstone"}). NULL values are treated as no data.
+    #
+    # Rocks are the names or ids of data.ROCKS. Samples without data and
+    # samples of lithologies without Holmes (2009) constants (shales, coals,
+    # volcanics) get NaN results, see grid.Grid.Chunk
+
+    def Run(fluid, paths, tsurf=20., setting=3, eos="PR78", step=0.01, scale=None,
+            curve="LITH", codes=None, batch=100000, water="eos", out=None,
+            format=None, partition_by=()):
+
+        # Results of all samples of all wells as one DataFrame, or with out
+        # set written to a dataset directory as they are calculated (see
+        # output.Writer), returning its metadata
+        frames = Well.Stream(fluid, paths, tsurf, setting, eos, step, scale, curve,
+                             codes, batch, water)
+        if out is None:
+            frames = list(frames)
+            if not frames:
+                return pd.DataFrame(columns=["well", "depth", "rock"] + list(grid.FIELDS))
+            return pd.concat(frames, ignore_index=True)
+
+        meta = {"well": {"fluid": fluid, "eos": eos, "water": water, "step": step,
+                         "paths": Well.Paths(paths)}}
+        with results.Writer(out, format, partition_by, meta) as writer:
+            for frame in frames:
+                writer.write(frame)
+
+        return writer.meta
+
+    def Stream(fluid, paths, tsurf=20., setting=3, eos="PR78", step=0.01, scale=None,
+               curve="LITH", codes=None, batch=100000, water="eos"):
+
+        # Generator of DataFrames of about batch samples (well, depth, rock and
+        # the grid.FIELDS columns) in the order of the logs. Samples of many
+        # wells share a batch, so short logs are evaluated together. tsurf is
+        # one value or a dict of values per well
+        wells = []                          # (well, number of samples) runs
+        depths = []
+        rows = []
+        for well, depth, row in Well.Samples(paths, step, scale, curve, codes):
+            if wells and wells[-1][0] == well:
+                wells[-1][1] += len(depth)
+            else:
+                wells.append([well, len(depth)])
+            depths.extend(depth)
+            rows.extend([row]*len(depth))
+            if len(depths) >= batch:
+                yield Well.Evaluate(fluid, wells, depths, rows, tsurf, setting, eos, water)
+                wells, depths, rows = [], [], []
+
+        if depths:
+            yield Well.Evaluate(fluid, wells, depths, rows, tsurf, setting, eos, water)
+
+    def Evaluate(fluid, wells, depths, rows, tsurf, setting, eos, water):
+
+        # One batch of samples, vectorized over all lithologies and wells
+        names = [well for well, n in wells]
+        counts = [n for well, n in wells]
+        well = np.repeat(np.array(names, dtype=object), counts)
+        if isinstance(tsurf, dict):
+            missing = [name for name in names if name not in tsurf]
+            if missing:
+                raise ValueError("No surface temperature for wells %s"
+                                 % ", ".join(map(str, missing)))
+            tsurf = np.repeat([float(tsurf[name]) for name in names], counts)
+
+        depth = np.array(depths, dtype=float)
+        rows = np.array(rows, dtype=np.intp)
+        cols = grid.Grid.Chunk(fluid, rows, depth, tsurf, setting, eos, water)
+
+        rock = np.array([r[0] for r in data.ROCKS] + [""], dtype=object)[rows]
+        frame = {"well": well, "depth": depth, "rock": rock}
+        frame.update({field: cols[column] for field, column in grid.FIELDS.items()})
+
+        return pd.DataFrame(frame)
+
+###############################################################################
+
+    def Paths(paths):
+
+        # Log files for a file, a directory (its .csv and .las files) or a list
+        if isinstance(paths, (str, os.PathLike)):
+            if os.path.isdir(paths):
+                return sorted(os.path.join(paths, name) for name in os.listdir(paths)
+                              if name.lower().endswith((".csv", ".las")))
+            return [os.fspath(paths)]
+
+        return [os.fspath(path) for path in paths]
+
+    def Samples(paths, step=0.01, scale=None, curve="LITH", codes=None):
+
+        # Generator of (well, depths in km, rock id) for every sample or
+        # interval of the logs, rock id -1 for no data
+        lookup = {}
+        for path in Well.Paths(paths):
+            with open(path, newline="") as f:
+                # the format from the first line that is not blank
+                start = 1
+                for first in f:
+                    if first.strip():
+                        break
+                    start += 1
+                else:
+                    continue
+                lines = itertools.chain([first], f)
+                if first.lstrip().startswith("~"):
+                    yield from Well.LAS(path, lines, start, scale, curve, codes, lookup)
+                else:
+                    yield from Well.CSV(path, lines, start, step, scale or 1., codes, 
+                                        lookup)
+
+    def Rock(value, codes, lookup, where):
+
+        # Rock id of a log value: a rock name, a rock id or a code (numbers 
+        # may be written as floats, e.g. 19.0000)
+        row = lookup.get(value)
+        if row is None:
+            try:
+                number = int(float(value))
+            except ValueError:
+                number = None
+            key = value if number is None else number
+            if codes is not None:
+                key = codes.get(value, codes.get(key, key))
+            try:
+                row = data.Data.Name(key)
+            except ValueError:
+                raise ValueError("%s: unknown rock type %r, see data.ROCKS or pass "
+                                 "codes" % (where, value)) from None
+            lookup[value] = row
+
+        return row
+
+    def CSV(path, lines, start, step, scale, codes, lookup):
+
+        # Samples of an interval or sample csv log
+        reader = csv.reader(lines)
+        header = [name.strip().lower() for name in next(reader)]
+        columns = {name: i for i, name in enumerate(header)}
+        if "rock" not in columns or not ("depth" in columns or
+                                         {"top", "base"} <= set(columns)):
+            raise ValueError("%s needs the columns rock and depth, or rock, top "
+                             "and base" % path)
+        default = os.path.splitext(os.path.basename(path))[0]
+        interval = "depth" not in columns
+
+        for line in reader:
+            if not line:
+                continue
+            where = "%s line %d" % (path, start - 1 + reader.line_num)
+            well = line[columns["well"]].strip() if "well" in columns else default
+            rock = line[columns["rock"]].strip()
+            row = Well.Rock(rock, codes, lookup, where) if rock else -1
+            if not interval:
+                yield well, [float(line[columns["depth"]])*scale], row
+                continue
+            top = float(line[columns["top"]])*scale
+            base = float(line[columns["base"]])*scale
+            if base <= top:
+                raise ValueError("%s: interval base must be below its top" % where)
+            yield well, np.arange(top, base, step).tolist(), row
+
+    def LAS(path, lines, start, scale, curve, codes, lookup):
+
+        # Samples of a LAS 2.0 log, one per line of the ~A section
+        section = None
+        well = os.path.splitext(os.path.basename(path))[0]
+        null = None
+        curves = []
+        units = []
+        for number, line in enumerate(lines, start):
+            text = line.strip()
+            if not text or text.startswith("#"):
+                continue
+            if text.startswith("~"):
+                section = text[1].upper()
+                if section == "A":
+                    names = [name.upper() for name in curves]
+                    depth = next((names.index(name) for name in ("DEPT", "DEPTH")
+                                  if name in names), None)
+                    if depth is None or curve.upper() not in names:
+                        raise ValueError("%s needs a DEPT and a %s curve" % (path, curve))
+                    lith = names.index(curve.upper())
+                    factor = scale or UNITS.get(units[depth].upper())
+                    if factor is None:
+                        raise ValueError("%s: unknown depth unit %r, pass scale"
+                                         % (path, units[depth]))
+                continue
+
+            if section in ("W", "C"):
+                # MNEM.UNIT  VALUE : DESCRIPTION
+                mnemonic, rest = text.split(".", 1)
+                unit = rest.split(" ", 1)[0].split(":", 1)[0]
+                value = rest[len(unit):].split(":", 1)[0].strip()
+                if section == "C":
+                    curves.append(mnemonic.strip())
+                    units.append(unit)
+                elif mnemonic.strip().upper() == "WELL" and value:
+                    well = value
+                elif mnemonic.strip().upper() == "NULL" and value:
+                    null = float(value)
+
+            elif section == "A":
+                values = text.split()
+                z = float(values[depth])*factor
+                value = values[lith]
+                try:
+                    nodata = null is not None and float(value) == null
+                except ValueError:
+                    nodata = False
+                if nodata:
+                    yield well, [z], -1
+                else:
+                    where = "%s line %d" % (path, number)
+                    yield well, [z], Well.Rock(value, codes, lookup, where)